@@ -0,0 +1,78 @@
+from typing import Any
+
+from Transaction import Transaction
+
+# a block's balances are stored as a full snapshot every SNAPSHOT_INTERVAL
+# blocks, in between only the balances the block changed are stored
+SNAPSHOT_INTERVAL = 32
+MISSING = object()
+
+
+class BranchBalances:
+    '''
+    Balances of every peer after a block.
+
+    Persistent: a block keeps the balances its transactions changed and
+    shares the rest with its ancestors, up to the closest full snapshot. A
+    lookup checks at most SNAPSHOT_INTERVAL layers, the newest first.
+    '''
+    __slots__ = ("__layers",)
+
+    def __init__(self, layers: tuple[dict[Any, float], ...]):
+        # newest first, the last layer is a snapshot of all peers
+        self.__layers = layers
+
+    @classmethod
+    def initial(cls, balances: dict[Any, float]) -> "BranchBalances":
+        return cls((dict(balances),))
+
+    def __getitem__(self, peer: Any) -> float:
+        for layer in self.__layers:
+            balance = layer.get(peer, MISSING)
+            if balance is not MISSING:
+                return balance
+        raise KeyError(peer)
+
+    def to_dict(self) -> dict[Any, float]:
+        balances = {}
+        for layer in reversed(self.__layers):
+            balances.update(layer)
+        return balances
+
+    def scratch(self) -> "ScratchBalances":
+        return ScratchBalances(self)
+
+    def after(self, transactions: list[Transaction]) -> "BranchBalances":
+        '''
+        Balances after applying transactions, sharing the unchanged ones.
+        '''
+        changes = self.scratch()
+        for transaction in transactions:
+            if transaction.from_id:
+                changes[transaction.from_id] -= transaction.amount
+            changes[transaction.to_id] += transaction.amount
+        if len(self.__layers) >= SNAPSHOT_INTERVAL:
+            snapshot = self.to_dict()
+            snapshot.update(changes.changes)
+            return BranchBalances((snapshot,))
+        return BranchBalances((changes.changes,) + self.__layers)
+
+
+class ScratchBalances:
+    '''
+    Writable view on BranchBalances, writes stay in the view.
+    '''
+    __slots__ = ("base", "changes")
+
+    def __init__(self, base: BranchBalances):
+        self.base: BranchBalances = base
+        self.changes: dict[Any, float] = {}
+
+    def __getitem__(self, peer: Any) -> float:
+        balance = self.changes.get(peer, MISSING)
+        if balance is MISSING:
+            return self.base[peer]
+        return balance
+
+    def __setitem__(self, peer: Any, balance: float):
+        self.changes[peer] = balance
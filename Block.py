@@ -1,52 +1,122 @@
 from typing import Any
 import random
 from copy import deepcopy
-from functools import reduce
 from Transaction import Transaction, CoinBaseTransaction
 import logging
 import hashlib
 
 from config import CONFIG
-from DiscreteEventSim import simulation, Event, EventType
-from utils import expon_distribution, generate_random_id
+from DiscreteEventSim import Simulation, Event, EventType
+from Mining import MiningScheduler
+from Balances import BranchBalances, MISSING
+from Mempool import Mempool
+from utils import generate_random_id, set_instance_state
 
 logger = logging.getLogger(__name__)
 
 
+EMPTY_MERKLE_ROOT = hashlib.sha256(b"no transactions").hexdigest()
+
+
+class MerkleAccumulator:
+    '''
+    Merkle-style commitment over a growing list of transaction ids.
+
+    Keeps the roots of the perfect subtrees over the leaves so far, one per
+    set bit of the number of leaves. Appending a leaf merges equal sized
+    subtrees like a binary counter increment, O(log n) hashes; the root
+    folds the subtree roots from right to left.
+    '''
+    __slots__ = ("__peaks",)
+
+    def __init__(self, leaves: list[str] = ()):
+        self.__peaks: list[tuple[int, bytes]] = []  # (height, digest)
+        for leaf in leaves:
+            self.append(leaf)
+
+    def append(self, leaf: str):
+        height, digest = 0, hashlib.sha256(leaf.encode()).digest()
+        peaks = self.__peaks
+        while peaks and peaks[-1][0] == height:
+            _, left = peaks.pop()
+            digest = hashlib.sha256(left + digest).digest()
+            height += 1
+        peaks.append((height, digest))
+
+    @property
+    def root(self) -> str:
+        if not self.__peaks:
+            return EMPTY_MERKLE_ROOT
+        digest = self.__peaks[-1][1]
+        for _, peak in reversed(self.__peaks[:-1]):
+            digest = hashlib.sha256(peak + digest).digest()
+        return digest.hex()
+
+
 class Block:
 
-    def __init__(self, prev_block, transactions: list[Transaction], miner: any, timestamp: float):
-        self.block_id: int = generate_random_id(4)
+    def __init__(self, prev_block, transactions: list[Transaction], miner: any, timestamp: float,
+                 rng: random.Random = random):
+        self.block_id: int = generate_random_id(4, rng)
         self.prev_block: "Block" = prev_block
         self.transactions: list[Transaction] = transactions
         self.timestamp: float = timestamp
         self.miner: any = miner
+        # built on first use, most candidate blocks are never hashed
+        self.__merkle: MerkleAccumulator = None
+        self.__hash: str = None
+
+        self.prev_block_hash = prev_block.block_hash() if prev_block else None
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("%s <%s> %s", self,
+                        EventType.BLOCK_CREATE, self.description())
 
-        self.prev_block_hash = hash(prev_block) if prev_block else None
+    __setstate__ = set_instance_state
 
-        logger.info(f"{self} <{EventType.BLOCK_CREATE}> {self.description()}")
+    def __reduce_ex__(self, protocol):
+        # the genesis block is shared by every chain, keep it shared
+        if self is GENESIS_BLOCK:
+            return "GENESIS_BLOCK"
+        return super().__reduce_ex__(protocol)
 
     @property
     def id(self) -> int:
         return self.block_id
 
+    @property
+    def merkle_root(self) -> str:
+        if self.__merkle is None:
+            self.__merkle = MerkleAccumulator(
+                [transaction.txn_id for transaction in self.transactions])
+        return self.__merkle.root
+
     @property
     def header(self) -> str:
         if self.block_id == 0:
             return hash("genesis block")
-        if self.transactions == []:
-            transaction_ids = "no transactions"
-        else:
-            transaction_ids = reduce(
-                lambda a, b: a+b, map(lambda x: x.txn_id, self.transactions))
-        return f"{self.block_id}-{self.prev_block_hash}-{self.timestamp}-{transaction_ids}"
+        return f"{self.block_id}-{self.prev_block_hash}-{self.timestamp}-{self.merkle_root}"
 
     @property
     def num_txns(self) -> int:
         return len(self.transactions)
 
-    def block_hash(self) -> int:
-        return hashlib.sha256(self.header.encode()).hexdigest()
+    def append_transaction(self, transaction: Transaction):
+        '''
+        Add a transaction (the coinbase) to the block before it is sealed.
+        '''
+        self.transactions.append(transaction)
+        if self.__merkle is not None:
+            self.__merkle.append(transaction.txn_id)
+        self.__hash = None
+
+    def block_hash(self) -> str:
+        '''
+        sha256 of the header, computed once the block is complete
+        '''
+        if self.__hash is None:
+            self.__hash = hashlib.sha256(self.header.encode()).hexdigest()
+        return self.__hash
 
     def __repr__(self) -> str:
         return f"Block(id={self.block_id})"
@@ -99,37 +169,359 @@ def gen_genesis_block():
 GENESIS_BLOCK = gen_genesis_block()
 
 
+def skip_height(height: int) -> int:
+    '''
+    Height the skip pointer of a block at height points to (genesis is at
+    height 1). The pattern (as in Bitcoin's CBlockIndex::pskip) lets
+    ancestor lookups finish in O(log n) jumps with one pointer per block.
+    '''
+    def invert_lowest_one(n: int) -> int:
+        return n & (n - 1)
+
+    depth = height - 1
+    if depth < 2:
+        return 1
+    if depth & 1:
+        return invert_lowest_one(invert_lowest_one(depth - 1)) + 2
+    return invert_lowest_one(depth) + 1
+
+
+class BlockRecord:
+    '''
+    What is known about a block regardless of which peers accepted it.
+    '''
+    __slots__ = ("block", "height", "skip", "balances")
+
+    def __init__(self, block: Block, balances: BranchBalances):
+        self.block: Block = block
+        self.height: int = 1  # chain length up to and including block
+        self.skip: Block = None  # ancestor at skip_height(height)
+        # after block; the block's own layer doubles as its balance undo log
+        self.balances: BranchBalances = balances
+
+
+class ValidationCache:
+    '''
+    Verdicts of block validation. A block is checked against its parent's
+    balances and ancestors, the same for every peer receiving it, so the
+    first peer validates and the others look the verdict up. A block's
+    parent is fixed when it is created, the block alone keys the (block,
+    parent) pair.
+
+    Bounded: at most max_size verdicts, oldest out first, and none for
+    blocks more than max_depth below the highest block seen (deep stale
+    forks are unlikely to arrive again, if one does it is validated anew).
+    '''
+
+    def __init__(self, max_size: int, max_depth: int):
+        self.max_size: int = max_size
+        self.max_depth: int = max_depth
+        self.hits: int = 0
+        self.misses: int = 0
+        self.num_evicted: int = 0
+        self.__verdicts: dict[Block, tuple[bool, int]] = {}  # oldest first
+        self.__max_height: int = 0
+
+    def __len__(self) -> int:
+        return len(self.__verdicts)
+
+    def get(self, block: Block) -> bool:
+        '''
+        Verdict for block, None if it is not cached.
+        '''
+        entry = self.__verdicts.get(block)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def put(self, block: Block, height: int, verdict: bool):
+        self.__verdicts[block] = (verdict, height)
+        self.__max_height = max(self.__max_height, height)
+        verdicts = self.__verdicts
+        while verdicts:
+            oldest, (_, oldest_height) = next(iter(verdicts.items()))
+            if len(verdicts) <= self.max_size and \
+                    self.__max_height - oldest_height <= self.max_depth:
+                break
+            del verdicts[oldest]
+            self.num_evicted += 1
+
+    @property
+    def info(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "num_evicted": self.num_evicted, "size": len(self)}
+
+
+class BlockStore:
+    '''
+    The block DAG of a simulation, shared by the block chains of its peers:
+    heights, balances and the inclusion index depend on a block and its
+    ancestors only, so they are stored once however many peers accept it.
+
+    Blocks are keyed by the Block object rather than block_id: ids are
+    short random strings and can collide on long runs.
+    '''
+
+    def __init__(self, initial_balances: dict[Any, float]):
+        self.__records: dict[Block, BlockRecord] = {
+            GENESIS_BLOCK: BlockRecord(GENESIS_BLOCK, BranchBalances.initial(initial_balances))}
+        # transaction -> blocks including it
+        self.__including: dict[Transaction, list[Block]] = {}
+        self.validation_cache: ValidationCache = ValidationCache(
+            CONFIG.VALIDATION_CACHE_SIZE, CONFIG.VALIDATION_CACHE_DEPTH)
+
+    def __contains__(self, block: Block) -> bool:
+        return block in self.__records
+
+    def __len__(self) -> int:
+        return len(self.__records)
+
+    def __iter__(self):
+        return iter(self.__records)
+
+    def __getitem__(self, block: Block) -> BlockRecord:
+        return self.__records[block]
+
+    def add(self, block: Block) -> BlockRecord:
+        '''
+        Add a block unless a peer already did, its parent must be in the store.
+        '''
+        record = self.__records.get(block)
+        if record is not None:
+            return record
+        parent_record = self.__records[block.prev_block]
+        record = BlockRecord(block, parent_record.balances.after(block.transactions))
+        record.height = parent_record.height + 1
+        record.skip = self.ancestor(block.prev_block, skip_height(record.height))
+        self.__records[block] = record
+        for transaction in block.transactions:
+            self.__including.setdefault(transaction, []).append(block)
+        return record
+
+    def parent(self, block: Block) -> Block:
+        return block.prev_block
+
+    def height(self, block: Block) -> int:
+        return self.__records[block].height
+
+    def ancestor(self, block: Block, height: int) -> Block:
+        '''
+        Ancestor of block at height (block itself at its own height).
+        '''
+        records = self.__records
+        record = records[block]
+        if height > record.height or height < 1:
+            raise ValueError(f"no ancestor of {block} at height {height}")
+        while record.height > height:
+            walk_height = record.height
+            jump_height = skip_height(walk_height)
+            prev_jump_height = skip_height(walk_height - 1)
+            # take the skip pointer unless the parent's one gets closer
+            if record.skip is not None and (jump_height == height or (
+                    jump_height > height and not (prev_jump_height < jump_height - 2
+                                                  and prev_jump_height >= height))):
+                record = records[record.skip]
+            else:
+                record = records[record.block.prev_block]
+        return record.block
+
+    def is_ancestor(self, ancestor: Block, block: Block) -> bool:
+        '''
+        ancestor is block or one of its ancestors.
+        '''
+        height = self.__records[ancestor].height
+        return height <= self.__records[block].height and self.ancestor(block, height) is ancestor
+
+    def reorg_path(self, old_tip: Block, new_tip: Block) -> tuple[list[Block], list[Block]]:
+        '''
+        Blocks leaving the chain (newest first) and joining it (oldest
+        first) when the tip moves from old_tip to new_tip.
+        '''
+        records = self.__records
+        disconnected, connected = [], []
+        while old_tip is not new_tip:
+            if records[old_tip].height >= records[new_tip].height:
+                disconnected.append(old_tip)
+                old_tip = old_tip.prev_block
+            else:
+                connected.append(new_tip)
+                new_tip = new_tip.prev_block
+        connected.reverse()
+        return disconnected, connected
+
+    def includes(self, block: Block, transaction: Transaction) -> bool:
+        '''
+        transaction is in block or one of its ancestors. Blocks other peers
+        added do not count: only ancestors of block are looked at.
+        '''
+        return any(self.is_ancestor(including, block)
+                   for including in self.__including.get(transaction, ()))
+
+
+class BlockView:
+    '''
+    The blocks one peer accepted, in order of arrival, on top of the shared
+    BlockStore. Only what differs between peers is kept here: when a block
+    arrived and, while it is on the peer's longest chain, what it took out
+    of the peer's mempool.
+    '''
+
+    def __init__(self, store: BlockStore):
+        self.store: BlockStore = store
+        self.__arrival: dict[Block, float] = {GENESIS_BLOCK: None}
+        # transactions a block on the longest chain took out of the mempool,
+        # back in when it leaves the chain
+        self.__undo_mempool: dict[Block, list[Transaction]] = {}
+
+    def __contains__(self, block: Block) -> bool:
+        return block in self.__arrival
+
+    def __len__(self) -> int:
+        return len(self.__arrival)
+
+    def __iter__(self):
+        return iter(self.__arrival)
+
+    def __getitem__(self, block: Block) -> BlockRecord:
+        return self.store[block]
+
+    def add(self, block: Block, arrival_time: float):
+        '''
+        Accept a block, its parent must have been accepted.
+        '''
+        self.store.add(block)
+        self.__arrival[block] = arrival_time
+
+    def set_undo_mempool(self, block: Block, undo_mempool: list[Transaction]):
+        if undo_mempool:
+            self.__undo_mempool[block] = undo_mempool
+
+    def arrival_time(self, block: Block) -> float:
+        return self.__arrival[block]
+
+    def pop_undo_mempool(self, block: Block) -> list[Transaction]:
+        return self.__undo_mempool.pop(block, ())
+
+    def height(self, block: Block) -> int:
+        return self.store.height(block)
+
+    def reorg_path(self, old_tip: Block, new_tip: Block) -> tuple[list[Block], list[Block]]:
+        return self.store.reorg_path(old_tip, new_tip)
+
+    def includes(self, block: Block, transaction: Transaction) -> bool:
+        return self.store.includes(block, transaction)
+
+
+class OrphanPool:
+    '''
+    Blocks whose parent has not arrived yet, indexed by the missing parent.
+    Holds each block once, at most max_size blocks, none older than max_age.
+    '''
+
+    def __init__(self, max_size: int, max_age: float):
+        self.max_size: int = max_size
+        self.max_age: float = max_age
+        self.num_evicted: int = 0
+        self.__by_parent: dict[Block, list[Block]] = {}
+        self.__arrival: dict[Block, float] = {}  # oldest first
+
+    def __len__(self) -> int:
+        return len(self.__arrival)
+
+    def __contains__(self, block: Block) -> bool:
+        return block in self.__arrival
+
+    def add(self, block: Block, time: float) -> bool:
+        '''
+        Hold block until its parent arrives, False if it is already held.
+        '''
+        if block in self.__arrival:
+            return False
+        self.__arrival[block] = time
+        self.__by_parent.setdefault(block.prev_block, []).append(block)
+        self.evict(time)
+        return True
+
+    def pop_children(self, parent: Block) -> list[Block]:
+        '''
+        Remove and return the blocks waiting for parent, oldest first.
+        '''
+        children = self.__by_parent.pop(parent, [])
+        for child in children:
+            del self.__arrival[child]
+        return children
+
+    def __remove(self, block: Block):
+        del self.__arrival[block]
+        siblings = self.__by_parent[block.prev_block]
+        siblings.remove(block)
+        if not siblings:
+            del self.__by_parent[block.prev_block]
+        self.num_evicted += 1
+
+    def evict(self, time: float):
+        '''
+        Drop the blocks older than max_age and the oldest beyond max_size.
+        '''
+        arrival = self.__arrival
+        while arrival:
+            oldest, arrival_time = next(iter(arrival.items()))
+            if len(arrival) <= self.max_size and time - arrival_time <= self.max_age:
+                break
+            logger.info("orphan %s evicted", oldest)
+            self.__remove(oldest)
+
+
 class BlockChain:
 
-    def __init__(self, cpu_power: float, broadcast_block_function: Any, peers: list[Any], owner_peer: Any):
-        self.__blocks: list[Block] = []
+    def __init__(self, simulation: Simulation, cpu_power: float, broadcast_block_function: Any,
+                 peers: list[Any], owner_peer: Any, mining_scheduler: MiningScheduler = None,
+                 block_store: BlockStore = None):
+        self.__simulation: Simulation = simulation
+        # per candidate mining timers unless a global scheduler is given
+        self.__mining_scheduler: MiningScheduler = mining_scheduler
+        # the simulation's block DAG unless the chain gets its own
+        if block_store is None:
+            block_store = BlockStore({peer: CONFIG.INITIAL_COINS for peer in peers})
+        self.__blocks: BlockView = BlockView(block_store)
         self.__peer_id: Any = owner_peer
         self.__num_generated_blocks: int = 0
-        self.__new_transactions: list[Transaction] = []
-        self.__block_arrival_time: dict[Block, float] = {}
+        self.__mempool: Mempool = None
+        self.__template_tip: Block = None  # tip the mempool's template is for
+        self.__reorgs: dict[str, int] = {"num_reorgs": 0, "max_depth": 0, "total_depth": 0,
+                                         "blocks_walked": 0, "reinjected_txns": 0}
         self.__broadcast_block: Any = broadcast_block_function
-        self.__mining_new_blocks: list[Block] = []
+        # candidate blocks being mined -> handle of their pending mining event
+        self.__mining_new_blocks: dict[Block, Any] = {}
         self.__pending_generate_block: bool = False
 
         self.__longest_chain_length: int = 0
         self.__longest_chain_leaf: Block = None
+        # kept up to date as blocks are added and the longest chain moves
+        self.__tips: dict[Block, None] = {}  # leaf blocks, in arrival order
+        self.__forks: dict[Block, int] = {}  # fork point -> number of children
+        self.__chain_miners: dict[Any, int] = {}  # miner -> blocks on the longest chain
+        self.__branches_info: dict = None  # cached until the next block
 
-        self.__branch_lengths: dict[Block, int] = {}
-        self.__branch_balances: dict[Block, dict[Any, int]] = {}
-        self.__branch_transactions: dict[Block, list[Transaction]] = {}
-        self.__missing_parent_blocks: list[Block] = []
+        self.__orphans = OrphanPool(
+            CONFIG.ORPHAN_POOL_SIZE, CONFIG.ORPHAN_MAX_AGE)
 
         self.avg_interval_time = CONFIG.AVG_BLOCK_MINING_TIME
         self.cpu_power: float = cpu_power
 
-        self.__init_genesis_block(peers)
+        self.__init_genesis_block()
+
+    __setstate__ = set_instance_state
 
     @property
     def __dict__(self) -> dict:
         blocks = list(map(lambda x: x.__dict__, self.__blocks))
         blocks = sorted(blocks, key=lambda x: x["block_id"])
-        block_arrival_times = list(map(lambda x: {x.__repr__(
-        ): self.__block_arrival_time[x]}, self.__block_arrival_time))
+        block_arrival_times = [{block.__repr__(): self.__blocks.arrival_time(block)}
+                               for block in self.__blocks
+                               if self.__blocks.arrival_time(block) is not None]
         block_arrival_times = sorted(
             block_arrival_times, key=lambda x: list(x.values())[0])
         longest_chain = self.__get_longest_chain()
@@ -143,26 +535,31 @@ class BlockChain:
             "cpu_power": self.cpu_power,
             "longest_chain": longest_chain,
             "branches_info": self.branches_info,
+            "reorg_info": self.reorg_info,
         }
 
     @ property
     def peer_id(self) -> Any:
         return self.__peer_id
 
+    @ property
+    def longest_chain_length(self) -> int:
+        return self.__longest_chain_length
+
+    @ property
+    def longest_chain_leaf(self) -> Block:
+        return self.__longest_chain_leaf
+
     def __repr__(self) -> str:
         return f"BlockChain(👥:{self.__peer_id})"
 
-    def __init_genesis_block(self, peers: list[Any]):
+    def __init_genesis_block(self):
         genesis_block = GENESIS_BLOCK
-        self.__blocks.append(genesis_block)
+        self.__tips[genesis_block] = None
+        self.__mempool = Mempool(self.__blocks[genesis_block].balances)
+        self.__template_tip = genesis_block
         self.__longest_chain_length = 1
         self.__longest_chain_leaf = genesis_block
-        self.__branch_lengths[genesis_block] = 1
-        self.__branch_balances[genesis_block] = {}
-        self.__branch_transactions[genesis_block] = []
-        for peer in peers:
-            self.__branch_balances[genesis_block].update(
-                {peer: CONFIG.INITIAL_COINS})
 
     def __validate_block(self, block: Block) -> bool:
         '''
@@ -173,18 +570,33 @@ class BlockChain:
         if prev_block not in self.__blocks:
             logger.info(
                 "%s block_dropped %s previous block missing !!", self.peer_id, block)
-            self.__missing_parent_blocks.append(block)
+            self.__orphans.add(block, self.__simulation.clock)
             return False
         if block in self.__blocks:
             logger.info(
                 "%s block_dropped %s block already in blockchain !!", self.peer_id, block)
             return False
+        cache = self.__blocks.store.validation_cache
+        verdict = cache.get(block)
+        if verdict is None:
+            verdict = self.__validate_transactions(block)
+            cache.put(block, self.__blocks.height(prev_block) + 1, verdict)
+        elif not verdict:
+            logger.info(
+                "%s block_dropped %s known invalid block !!", self.peer_id, block)
+        return verdict
+
+    def __validate_transactions(self, block: Block) -> bool:
+        '''
+        The same for every peer: depends on the block and its parent only.
+        '''
+        prev_block = block.prev_block
         for transaction in block.transactions:
             if not self.__validate_transaction(transaction, prev_block):
                 logger.info(
                     "%s block_dropped %s invalid transaction !!", self.peer_id, block)
                 return False
-            if transaction in self.__branch_transactions[prev_block]:
+            if self.__blocks.includes(prev_block, transaction):
                 logger.info(
                     "%s block_dropped %s %s transaction already in blockchain!!", self.peer_id, block, transaction)
                 return False
@@ -196,7 +608,7 @@ class BlockChain:
         '''
         1. no balance of any peer shouldn't go negative
         '''
-        balances_upto_block = self.__branch_balances[prev_block]
+        balances_upto_block = self.__blocks[prev_block].balances
         if transaction.from_id and balances_upto_block[transaction.from_id] < transaction.amount:
             # logger.debug(f"Transaction {transaction} is invalid")
             return False
@@ -204,24 +616,6 @@ class BlockChain:
         # logger.debug(f"Transaction {transaction} is valid")
         return True
 
-    def __update_chain_length(self, block: Block):
-        prev_block = block.prev_block
-        chain_len_upto_block = self.__branch_lengths[prev_block] + 1
-        self.__branch_lengths[block] = chain_len_upto_block
-        # self.__branch_lengths.pop(prev_block)
-        # logger.debug(f"Chain length upto block {block} is {chain_len_upto_block}")
-
-    def __update_balances(self, block: Block):
-        prev_block = block.prev_block
-        balances_upto_block = self.__branch_balances[prev_block].copy()
-        for transaction in block.transactions:
-            if transaction.from_id:
-                balances_upto_block[transaction.from_id] -= transaction.amount
-            balances_upto_block[transaction.to_id] += transaction.amount
-        self.__branch_balances[block] = balances_upto_block
-        # self.__branch_balances.pop(prev_block)
-        # logger.debug(f"Balances upto block {block} are {balances_upto_block}")
-
     def __update_avg_interval_time(self, block: Block):
         return
         # prev_block = block.prev_block
@@ -233,42 +627,40 @@ class BlockChain:
         #     self.avg_interval_time * (num_blocks-1) + interval_time) / num_blocks
         # logger.debug("Avg interval updated %s", self.avg_interval_time)
 
-    def __update_branch_transactions(self, block: Block):
-        prev_block = block.prev_block
-        prev_branch_txns = (self.__branch_transactions[prev_block]).copy()
-        for transaction in block.transactions:
-            prev_branch_txns.append(transaction)
-        self.__branch_transactions[block] = prev_branch_txns
-
-    def __update_block_arrival_time(self, block: Block):
-        self.__block_arrival_time[block] = simulation.clock
-
     def __add_block(self, block: Block) -> bool:
         '''
-        Add a block to the chain
+        Add a block to the chain, its transactions leave the mempool only
+        once it is on the longest chain.
         '''
-        for transaction in block.transactions:
-            # if transaction in self.__new_transactions:
-            if isinstance(transaction, CoinBaseTransaction):
-                continue
-            if transaction in self.__new_transactions:
-                self.__new_transactions.remove(transaction)
-
-        self.__blocks.append(block)
-        self.__update_chain_length(block)
-        self.__update_balances(block)
-        self.__update_block_arrival_time(block)
+        self.__blocks.add(block, self.__simulation.clock)
+        self.__update_tips(block)
         self.__update_avg_interval_time(block)
-        self.__update_branch_transactions(block)
 
-    def __validate_saved_blocks(self):
-        remove_blocks = []
-        for block in self.__missing_parent_blocks:
-            if self.__validate_block(block):
-                remove_blocks.append(block)
-                self.__add_block(block)
-        for block in remove_blocks:
-            self.__missing_parent_blocks.remove(block)
+    def __update_tips(self, block: Block):
+        parent = block.prev_block
+        if self.__tips.pop(parent, MISSING) is MISSING:
+            # parent already had a child
+            self.__forks[parent] = self.__forks.get(parent, 1) + 1
+        self.__tips[block] = None
+        self.__branches_info = None
+
+    def __connect_orphans(self, block: Block) -> Block:
+        '''
+        Add the orphans descending from the newly added block, returns the
+        highest block added (block itself unless an orphan is higher).
+        '''
+        highest = block
+        worklist = [block]
+        while worklist:
+            parent = worklist.pop()
+            for orphan in self.__orphans.pop_children(parent):
+                if not self.__validate_block(orphan):
+                    continue
+                self.__add_block(orphan)
+                worklist.append(orphan)
+                if self.__blocks.height(orphan) > self.__blocks.height(highest):
+                    highest = orphan
+        return highest
 
     def add_block(self, block: Block) -> bool:
         '''
@@ -279,15 +671,73 @@ class BlockChain:
 
         self.__add_block(block)
 
-        chain_len_upto_block = self.__branch_lengths[block]
-        self.__validate_saved_blocks()
+        block = self.__connect_orphans(block)
+        chain_len_upto_block = self.__blocks.height(block)
         if chain_len_upto_block > self.__longest_chain_length:
             logger.debug("%s <longest_chain> %s %s generating new block !!",
                          self.__peer_id,
                          str(self.__longest_chain_length), str(chain_len_upto_block))
-            self.__longest_chain_length = chain_len_upto_block
-            self.__longest_chain_leaf = block
+            self.__move_longest_chain_to(block)
+            self.__cancel_stale_mining()
             self.__generate_block()
+        return True
+
+    def __move_longest_chain_to(self, new_leaf: Block):
+        '''
+        Make new_leaf the tip of the longest chain, walking back only to the
+        fork point with the old one.
+        '''
+        disconnected, connected = self.__blocks.reorg_path(
+            self.__longest_chain_leaf, new_leaf)
+        for block in disconnected:
+            self.__chain_miners[block.miner] -= 1
+        for block in connected:
+            self.__chain_miners[block.miner] = self.__chain_miners.get(block.miner, 0) + 1
+        self.__undo_abandoned_branch(new_leaf, disconnected, connected)
+        for block in connected:
+            self.__blocks.set_undo_mempool(block, [
+                transaction for transaction in block.transactions
+                if not isinstance(transaction, CoinBaseTransaction)
+                and self.__mempool.remove(transaction)])
+        self.__longest_chain_length = self.__blocks.height(new_leaf)
+        self.__longest_chain_leaf = new_leaf
+
+    def __undo_abandoned_branch(self, new_leaf: Block, disconnected: list[Block],
+                                connected: list[Block]):
+        '''
+        Return the transactions of the blocks leaving the longest chain to
+        the mempool.
+        '''
+        if not disconnected:
+            return
+        num_reinjected = 0
+        for block in disconnected:
+            for transaction in self.__blocks.pop_undo_mempool(block):
+                if not self.__blocks.includes(new_leaf, transaction):
+                    self.__mempool.add(transaction)
+                    num_reinjected += 1
+        depth = len(disconnected)
+        self.__reorgs["num_reorgs"] += 1
+        self.__reorgs["max_depth"] = max(self.__reorgs["max_depth"], depth)
+        self.__reorgs["total_depth"] += depth
+        self.__reorgs["blocks_walked"] += depth + len(connected)
+        self.__reorgs["reinjected_txns"] += num_reinjected
+        logger.info("%s <reorg> depth %d, %d txns back to the mempool",
+                    self.__peer_id, depth, num_reinjected)
+
+    @ property
+    def validation_info(self) -> dict:
+        '''
+        hits and misses of the validation cache, shared by the peers
+        '''
+        return self.__blocks.store.validation_cache.info
+
+    @ property
+    def reorg_info(self) -> dict:
+        '''
+        number of reorgs, their depths and cost (blocks walked)
+        '''
+        return dict(self.__reorgs)
 
     def add_transaction(self, transaction: Transaction) -> bool:
         '''
@@ -295,35 +745,45 @@ class BlockChain:
         '''
         # if transaction in self.__branch_transactions:
         # return
-        self.__new_transactions.append(transaction)
+        self.__mempool.add(transaction)
         if transaction.from_id == self.__peer_id:
             return
-        if self.__pending_generate_block and len(self.__new_transactions) >= CONFIG.BLOCK_TXNS_TRIGGER_THRESHOLD:
+        if self.__pending_generate_block and len(self.__mempool) >= CONFIG.BLOCK_TXNS_TRIGGER_THRESHOLD:
             self.__pending_generate_block = False
             self.__generate_block()
 
     def __mine_block_start(self, block: Block):
-        delay = expon_distribution(self.avg_interval_time/self.cpu_power)
+        if self.__mining_scheduler is not None:
+            self.__mining_new_blocks[block] = None
+            self.__mining_scheduler.start(
+                self, block, self.cpu_power/self.avg_interval_time)
+            return
+
+        delay = self.__simulation.streams.mining.exponential(
+            self.avg_interval_time/self.cpu_power)
 
-        new_event = Event(EventType.BLOCK_MINE_FINISH, simulation.clock, delay,
-                          self.__mine_block_end, (block,), f"mining block finished {block}")
-        simulation.enqueue(new_event)
+        new_event = Event(EventType.BLOCK_MINE_FINISH, self.__simulation.clock, delay,
+                          self.__mine_block_end, (block,),
+                          "mining block finished %s", block, owner=self.__peer_id)
+        self.__mining_new_blocks[block] = self.__simulation.enqueue(new_event)
 
     def __mine_block_end(self, block: Block):
         '''
         Broadcast a block to all connected peers.
         '''
-        self.__mining_new_blocks.remove(block)
+        self.__mining_new_blocks.pop(block)
         self.__num_generated_blocks += 1
         if block.prev_block == self.__longest_chain_leaf and self.__validate_block(block):
             logger.info(
                 "%s <%s> %s", self.__peer_id, EventType.BLOCK_MINE_SUCCESS, block)
-            block.transactions.append(CoinBaseTransaction(
-                self.__peer_id, block.timestamp))
+            block.append_transaction(CoinBaseTransaction(
+                self.__peer_id, block.timestamp, self.__simulation.rng))
+            # the cached verdict still holds: the coinbase spends nothing
             self.__add_block(block)
-            new_event = Event(EventType.BLOCK_BROADCAST, simulation.clock, 0,
-                              self.__broadcast_block, (block,), f"{self.__peer_id}->* broadcast {block}")
-            simulation.enqueue(new_event)
+            new_event = Event(EventType.BLOCK_BROADCAST, self.__simulation.clock, 0,
+                              self.__broadcast_block, (block,),
+                              "%s->* broadcast %s", self.__peer_id, block, owner=self.__peer_id)
+            self.__simulation.enqueue(new_event)
         else:
             # no longer longest chain
             logger.info(
@@ -331,33 +791,61 @@ class BlockChain:
         logger.info('restarting block minining')
         # self.__generate_block()
 
+    def finish_mining(self, block: Block):
+        '''
+        block was found by the global mining scheduler
+        '''
+        self.__mine_block_end(block)
+
+    def __move_template_to(self, tip: Block):
+        '''
+        Re-base the mempool's block template on tip, re-evaluating only the
+        peers whose balance differs between the old and the new tip.
+        '''
+        if tip is self.__template_tip:
+            return
+        disconnected, connected = self.__blocks.reorg_path(self.__template_tip, tip)
+        changed = set()
+        for block in disconnected + connected:
+            for transaction in block.transactions:
+                changed.add(transaction.from_id)
+                changed.add(transaction.to_id)
+        self.__mempool.set_balances(self.__blocks[tip].balances, changed)
+        self.__template_tip = tip
+
     def __generate_block(self) -> Block:
         '''
         Generate a new block
         '''
-        sorted(self.__new_transactions, key=lambda x: x.timestamp)
-        valid_transactions_for_longest_chain = []
-        balances_upto_block = self.__branch_balances[self.__longest_chain_leaf].copy(
-        )
-        for transaction in self.__new_transactions:
-            if balances_upto_block[transaction.from_id] < transaction.amount:
-                continue
-            balances_upto_block[transaction.from_id] -= transaction.amount
-            balances_upto_block[transaction.to_id] += transaction.amount
-            valid_transactions_for_longest_chain.append(transaction)
-
-        if len(valid_transactions_for_longest_chain) < CONFIG.BLOCK_TXNS_MIN_THRESHOLD:
+        self.__move_template_to(self.__longest_chain_leaf)
+        if self.__mempool.template_size() < CONFIG.BLOCK_TXNS_MIN_THRESHOLD:
             logger.debug("<num_txns> not enough txns to mine a block !!",)
             self.__pending_generate_block = True
             return
 
         new_block = Block(self.__longest_chain_leaf,
-                          valid_transactions_for_longest_chain,
-                          self.peer_id, simulation.clock)
-        self.__mining_new_blocks.append(new_block)
-        new_event = Event(EventType.BLOCK_MINE_START, simulation.clock, 0,
-                          self.__mine_block_start, (new_block,), f"attempt to mine block {new_block}")
-        simulation.enqueue(new_event)
+                          self.__mempool.template(),
+                          self.peer_id, self.__simulation.clock, self.__simulation.rng)
+        new_event = Event(EventType.BLOCK_MINE_START, self.__simulation.clock, 0,
+                          self.__mine_block_start, (new_block,),
+                          "attempt to mine block %s", new_block, owner=self.__peer_id)
+        self.__mining_new_blocks[new_block] = self.__simulation.enqueue(new_event)
+
+    def __cancel_stale_mining(self):
+        '''
+        Stop mining candidates that no longer extend the longest chain,
+        their mining events would only end in BLOCK_MINE_FAIL.
+        '''
+        for block in list(self.__mining_new_blocks):
+            if block.prev_block == self.__longest_chain_leaf:
+                continue
+            handle = self.__mining_new_blocks.pop(block)
+            if handle is None:
+                self.__mining_scheduler.stop(self, block)
+            else:
+                self.__simulation.cancel(handle)
+            logger.info(
+                "%s <%s> %s cancelled", self.__peer_id, EventType.BLOCK_MINE_FAIL, block)
 
     def generate_block(self):
         self.__generate_block()
@@ -370,26 +858,15 @@ class BlockChain:
             cur_chain = cur_chain.prev_block
         return chain
 
-    def __get_leaf_blocks(self):
-        '''
-        return leaf blocks
-        '''
-        leaf_blocks = self.__blocks.copy()
-        for block in self.__blocks:
-            if block.prev_block in leaf_blocks:
-                leaf_blocks.remove(block.prev_block)
-        return leaf_blocks
-
     def __get_branches(self):
         '''
         return branch lengths
         '''
-        leaf_blocks = self.__get_leaf_blocks()
         branch_lengths = []
-        for block in leaf_blocks:
+        for block in self.__tips:
             branch_lengths.append({
                 "leaf_block": block.__repr__(),
-                "length": self.__branch_lengths[block]
+                "length": self.__blocks.height(block)
             })
         return branch_lengths
 
@@ -397,21 +874,12 @@ class BlockChain:
         '''
         return forks
         '''
-        child_counts = {}
-        for block in self.__blocks:
-            prev_block = block.prev_block
-            if not prev_block:
-                continue
-            if prev_block not in child_counts:
-                child_counts[prev_block] = 0
-            child_counts[prev_block] = child_counts[prev_block] + 1
         forks = []
-        for block, child_freq in child_counts.items():
-            if child_freq > 1:
-                forks.append({
-                    "fork_at": block.__repr__(),
-                    "num_forks": child_freq
-                })
+        for block, child_freq in self.__forks.items():
+            forks.append({
+                "fork_at": block.__repr__(),
+                "num_forks": child_freq
+            })
         return forks
 
     @ property
@@ -420,23 +888,20 @@ class BlockChain:
         number of forks
         number of branches and their lengths
         '''
-        branches = self.__get_branches()
-        forks = self.__get_forks()
-
-        return {
-            "num_forks": len(forks),
-            "num_branches": len(branches),
-            "forks": forks,
-            "branches": branches
-        }
+        if self.__branches_info is None:
+            branches = self.__get_branches()
+            forks = self.__get_forks()
+            self.__branches_info = {
+                "num_forks": len(forks),
+                "num_branches": len(branches),
+                "forks": forks,
+                "branches": branches
+            }
+        return self.__branches_info
 
     @ property
     def longest_chain_contribution(self):
-        count_longest_chain = 0
-        for block in self.__get_longest_chain():
-            if block.miner == self.__peer_id:
-                count_longest_chain += 1
-
+        count_longest_chain = self.__chain_miners.get(self.__peer_id, 0)
         if self.__num_generated_blocks == 0:
             return 0
         return round(count_longest_chain/self.__num_generated_blocks*100, 2)
@@ -1,10 +1,15 @@
-import inspect
+import random
+from abc import ABC, abstractmethod
 from enum import Enum
-from queue import PriorityQueue
+from bisect import insort
+from heapq import heapify, heappush, heappop, nsmallest
+from itertools import count
+from typing import Any
 import logging
 
 
-import utils as UITLS
+from config import CONFIG
+from RandomStreams import RandomStreams
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +26,9 @@ class EventType(Enum):
     BLOCK_BROADCAST = 'BLOCK_BROADCASTED'
     BLOCK_ACCEPTED = 'BLOCK_ACCEPTED'  # BLOCK VALIDATED, ACCEPTED INTO BLOCKCHAIN
 
+    BATCH_SEND = 'BATCH_SENT'  # messages queued on a link go out
+    BATCH_RECEIVE = 'BATCH_RECEIVED'
+
     BLOCK_MINE_START = 'BLOCK_MINE_STARTED'
     BLOCK_MINE_FINISH = 'BLOCK_MINE_FINISHED'
     BLOCK_MINE_SUCCESS = 'BLOCK_MINE_SUCCESSFUL'
@@ -31,32 +39,36 @@ class EventType(Enum):
 
 
 class Event:
-    def __init__(self, event_type: EventType, created_at, delay, action, payload, meta_description=""):
-        self.id = UITLS.generate_random_id(6)
+    '''
+    A scheduled action.
+
+    meta_description is a %-style format string which is only formatted
+    together with meta_args when a description is actually requested
+    (by a log handler or a trace hook), never when the event is created.
+    '''
+    __slots__ = ("id", "type", "created_at", "delay", "actionable_at",
+                 "action", "payload", "owner", "__meta_format", "__meta_args")
+    __ids = count()
+
+    def __init__(self, event_type: EventType, created_at, delay, action, payload,
+                 meta_description="", *meta_args, owner: Any = "nan"):
+        self.id: int = next(Event.__ids)
         self.type: EventType = event_type  # type of the event
         self.created_at = created_at  # when it is created
         self.delay = delay
-        self.actionable_at = self.created_at + delay  # when it should be executed
+        self.actionable_at = created_at + delay  # when it should be executed
         self.action = action  # what to execute
         self.payload = payload  # arguments for the action
-        self.log_message = ""  # log message
+        self.owner = owner  # who scheduled the event
         # additional information about the event
-        self.meta_description = meta_description
-
-        self.owner = "nan"
-        try:
-            caller_class = inspect.currentframe().f_back.f_locals['self']
-            self.owner = caller_class
-            caller_class_name = caller_class.__class__.__name__
-            if caller_class_name == "BlockChain":
-                self.owner = f"{caller_class.peer_id}"
-            if caller_class_name == "OneWayLINK":
-                self.owner = f"{caller_class.from_peer}->{caller_class.to_peer}"
-        except Exception:
-            try:
-                self.owner = inspect.currentframe().f_back.f_locals['module']
-            except Exception:
-                pass
+        self.__meta_format: str = meta_description
+        self.__meta_args: tuple = meta_args
+
+    @property
+    def meta_description(self) -> str:
+        if self.__meta_args:
+            return self.__meta_format % self.__meta_args
+        return self.__meta_format
 
     def __gt__(self, other):
         return self.actionable_at > other.actionable_at
@@ -79,68 +91,365 @@ class Event:
         return f"📆(🔀:{self.type} 👷:{self.owner} ⏰️:{self.created_at_formatted}-{self.actionable_at_formatted} 📦:{self.payload})"
 
 
+class EventQueue(ABC):
+    '''
+    Interface of the pending-event set used by Simulation.
+
+    Events are ordered by (actionable_at, insertion order), so events scheduled
+    for the same time run in FIFO order. Every backend stores [time, seq, event]
+    entries; the entry doubles as the handle returned by push() and accepted by
+    cancel(). Cancellation is lazy: the entry is marked and skipped when it
+    reaches the front. The queue is only driven from the simulation loop, so
+    no backend takes locks.
+    '''
+
+    def __init__(self):
+        self._seq = count()
+        self._num_entries: int = 0  # entries stored, including cancelled ones
+        self._num_cancelled: int = 0  # cancelled entries still stored
+
+    def __len__(self) -> int:
+        return self._num_entries - self._num_cancelled
+
+    def __bool__(self) -> bool:
+        return self._num_entries > self._num_cancelled
+
+    def _new_entry(self, event: Event) -> list:
+        self._num_entries += 1
+        return [event.actionable_at, next(self._seq), event]
+
+    @abstractmethod
+    def push(self, event: Event) -> list:
+        '''
+        Schedule an event, returns a handle that can be passed to cancel().
+        '''
+
+    @abstractmethod
+    def peek(self) -> Event:
+        '''
+        Next event to run, without removing it.
+        '''
+
+    @abstractmethod
+    def pop(self) -> Event:
+        '''
+        Remove and return the next event to run.
+        '''
+
+    def cancel(self, handle: list) -> bool:
+        '''
+        Lazily cancel a scheduled event in O(1).
+        Returns False if the event already ran or was cancelled before.
+        '''
+        if handle[2] is None:
+            return False
+        handle[2] = None
+        self._num_cancelled += 1
+        return True
+
+
+class EventCalendar(EventQueue):
+    '''
+    Binary-heap backend, O(log n) push and pop.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.__heap: list[list] = []
+
+    def push(self, event: Event) -> list:
+        entry = self._new_entry(event)
+        heappush(self.__heap, entry)
+        return entry
+
+    def cancel(self, handle: list) -> bool:
+        if not super().cancel(handle):
+            return False
+        if self._num_cancelled > self._num_entries // 2:
+            self.__compact()
+        return True
+
+    def __compact(self):
+        '''
+        Drop cancelled entries once they make up half of the heap.
+        '''
+        self.__heap = [entry for entry in self.__heap if entry[2] is not None]
+        heapify(self.__heap)
+        self._num_entries = len(self.__heap)
+        self._num_cancelled = 0
+
+    def __discard_cancelled(self):
+        heap = self.__heap
+        while heap and heap[0][2] is None:
+            heappop(heap)
+            self._num_entries -= 1
+            self._num_cancelled -= 1
+
+    def peek(self) -> Event:
+        self.__discard_cancelled()
+        if not self.__heap:
+            raise IndexError("peek from an empty event calendar")
+        return self.__heap[0][2]
+
+    def pop(self) -> Event:
+        self.__discard_cancelled()
+        if not self.__heap:
+            raise IndexError("pop from an empty event calendar")
+        entry = heappop(self.__heap)
+        self._num_entries -= 1
+        event = entry[2]
+        entry[2] = None  # a handle to an executed event can't be cancelled
+        return event
+
+
+class CalendarQueue(EventQueue):
+    '''
+    Calendar queue backend (R. Brown, 1988), amortised O(1) push and pop.
+
+    Time is cut into buckets of equal width which are laid out cyclically
+    over an array ("days of a year"); every bucket holds its entries sorted.
+    Popping walks the days starting from the current one and takes the head
+    of the first bucket whose head falls in the current year. The number of
+    buckets follows the queue size and the width is re-estimated from the
+    spacing of the earliest events on every resize, which keeps buckets
+    short for the exponential inter-event times of the simulator.
+    '''
+    MIN_BUCKETS = 2
+    RESIZE_SAMPLE = 25
+
+    def __init__(self):
+        super().__init__()
+        self.__width: float = 1.0
+        self.__buckets: list[list[list]] = [[] for _ in range(self.MIN_BUCKETS)]
+        self.__mask: int = self.MIN_BUCKETS - 1
+        self.__cur_day: int = 0  # no pending event lies before this day
+
+    def push(self, event: Event) -> list:
+        entry = self._new_entry(event)
+        day = int(entry[0] / self.__width)
+        insort(self.__buckets[day & self.__mask], entry)
+        if day < self.__cur_day:
+            self.__cur_day = day
+        if self._num_entries > 2 * len(self.__buckets):
+            self.__resize(2 * len(self.__buckets))
+        return entry
+
+    def __head_bucket(self) -> list[list]:
+        '''
+        Bucket holding the earliest live entry, None if the queue is empty.
+        '''
+        if not self:
+            return None
+        buckets, mask, width = self.__buckets, self.__mask, self.__width
+        day = self.__cur_day
+        for _ in range(len(buckets)):
+            bucket = buckets[day & mask]
+            while bucket and bucket[0][2] is None:
+                del bucket[0]
+                self._num_entries -= 1
+                self._num_cancelled -= 1
+            if bucket and int(bucket[0][0] / width) <= day:
+                self.__cur_day = day
+                return bucket
+            day += 1
+        # nothing within a year, jump straight to the earliest entry
+        bucket = min((bucket for bucket in buckets if bucket),
+                     key=lambda bucket: bucket[0])
+        self.__cur_day = int(bucket[0][0] / width)
+        return bucket
+
+    def __resize(self, num_buckets: int):
+        entries = [entry
+                   for bucket in self.__buckets
+                   for entry in bucket if entry[2] is not None]
+        self._num_entries = len(entries)
+        self._num_cancelled = 0
+        self.__width = self.__estimate_width(entries)
+        self.__buckets = [[] for _ in range(num_buckets)]
+        self.__mask = num_buckets - 1
+        width, mask, buckets = self.__width, self.__mask, self.__buckets
+        for entry in entries:
+            buckets[int(entry[0] / width) & mask].append(entry)
+        for bucket in buckets:
+            bucket.sort()
+        if entries:
+            self.__cur_day = int(min(entries)[0] / width)
+
+    def __estimate_width(self, entries: list[list]) -> float:
+        '''
+        Three times the average gap between the earliest events,
+        ignoring gaps far above the average.
+        '''
+        sample = nsmallest(self.RESIZE_SAMPLE, entries)
+        gaps = [b[0] - a[0] for a, b in zip(sample, sample[1:])]
+        if not gaps:
+            return self.__width
+        avg_gap = sum(gaps) / len(gaps)
+        gaps = [gap for gap in gaps if gap <= 2 * avg_gap]
+        avg_gap = sum(gaps) / len(gaps) if gaps else avg_gap
+        return 3 * avg_gap if avg_gap > 0 else self.__width
+
+    def peek(self) -> Event:
+        bucket = self.__head_bucket()
+        if bucket is None:
+            raise IndexError("peek from an empty calendar queue")
+        return bucket[0][2]
+
+    def pop(self) -> Event:
+        bucket = self.__head_bucket()
+        if bucket is None:
+            raise IndexError("pop from an empty calendar queue")
+        entry = bucket.pop(0)
+        self._num_entries -= 1
+        event = entry[2]
+        entry[2] = None  # a handle to an executed event can't be cancelled
+        if (self._num_entries < len(self.__buckets) // 2
+                and len(self.__buckets) > self.MIN_BUCKETS):
+            self.__resize(len(self.__buckets) // 2)
+        return event
+
+
+EVENT_QUEUE_BACKENDS: dict[str, type[EventQueue]] = {
+    "heap": EventCalendar,
+    "calendar": CalendarQueue,
+}
+
+
 class HookType():
     PRE_ENQUEUE = 'pre_enqueue'
     POST_ENQUEUE = 'post_enqueue'
     PRE_RUN = 'pre_run'
     POST_RUN = 'post_run'
 
+    ALL = (PRE_ENQUEUE, POST_ENQUEUE, PRE_RUN, POST_RUN)
+
+
+# events which are only traced at debug level
+DEBUG_EVENT_TYPES = frozenset([EventType.TXN_SEND, EventType.BLOCK_SEND, EventType.BATCH_SEND])
+
 
 class Simulation:
-    def __init__(self):
+    '''
+    Event loop and context of one simulation run.
+
+    Everything taking part in a run (peers, links, block chains) holds a
+    reference to its Simulation and draws random numbers from its rng, so
+    several simulations can live in one process without sharing state.
+    '''
+
+    def __init__(self, queue_backend: str = None, seed=None):
         self.clock = 0.0
-        self.event_queue = PriorityQueue()
-        self.__hooks = {
-            HookType.PRE_ENQUEUE: [],
-            HookType.POST_ENQUEUE: [],
-            HookType.PRE_RUN: [],
-            HookType.POST_RUN: []
+        self.rng = random.Random(seed)
+        # the variates drawn most often, in NumPy blocks
+        self.streams: RandomStreams = RandomStreams(seed)
+        queue_backend = queue_backend or CONFIG.EVENT_QUEUE_BACKEND
+        self.event_queue: EventQueue = EVENT_QUEUE_BACKENDS[queue_backend]()
+        # hook type -> event type -> hooks; event types without hooks are left out
+        self.__hooks: dict[str, dict[EventType, tuple]] = {
+            hook_type: {} for hook_type in HookType.ALL
         }
         self.stop_sim = False
+        self.num_cancelled_events: int = 0  # events cancelled before running
 
     def __enqueue(self, event):
-        self.__execute_hooks(HookType.PRE_ENQUEUE, event)
-        self.event_queue.put(event)
+        hooks = self.__hooks[HookType.PRE_ENQUEUE].get(event.type)
+        if hooks:
+            for hook in hooks:
+                hook(event)
+        handle = self.event_queue.push(event)
         # logger.debug("Scheduled: %s", event)
         # logger.info(f"Event payload: {event.payload}\n")
-        self.__execute_hooks(HookType.POST_ENQUEUE, event)
+        hooks = self.__hooks[HookType.POST_ENQUEUE].get(event.type)
+        if hooks:
+            for hook in hooks:
+                hook(event)
+        return handle
 
     def enqueue(self, event):
         '''
         Enqueue an event to the event queue.
+        Returns a handle which can be used to cancel the event.
+        '''
+        return self.__enqueue(event)
+
+    def cancel(self, handle) -> bool:
+        '''
+        Cancel a previously enqueued event.
         '''
-        self.__enqueue(event)
+        if not self.event_queue.cancel(handle):
+            return False
+        self.num_cancelled_events += 1
+        return True
 
-    def reg_hooks(self, hook_type: HookType, fn):
+    def reg_hooks(self, hook_type: HookType, fn, event_types: set[EventType] = None):
         '''
-        Register a function to be called before running an event.
+        Register a function to be called at hook_type for events of the given
+        types, or for every event if no types are given.
         '''
-        self.__hooks[hook_type].append(fn)
+        table = self.__hooks[hook_type]
+        for event_type in (event_types or EventType):
+            table[event_type] = table.get(event_type, ()) + (fn,)
 
-    def __execute_hooks(self, hook_type, event):
+    def is_traced(self, event_type: EventType) -> bool:
         '''
-        Execute hooks for the event.
+        Whether running an event of event_type is observed, by run hooks or
+        the log.
         '''
-        for hook in self.__hooks[hook_type]:
+        if event_type in self.__hooks[HookType.PRE_RUN] or event_type in self.__hooks[HookType.POST_RUN]:
+            return True
+        return logger.isEnabledFor(logging.DEBUG if event_type in DEBUG_EVENT_TYPES else logging.INFO)
+
+    def trace(self, event):
+        '''
+        Pass an event which takes no simulated time and is not queued (e.g.
+        a message leaving a link) to the run hooks and the log, as if it ran.
+        '''
+        hooks = self.__hooks[HookType.PRE_RUN].get(event.type, ())
+        for hook in hooks:
+            hook(event)
+        if event.type in DEBUG_EVENT_TYPES:
+            logger.debug("Traced: %s", event)
+        else:
+            logger.info("Traced: %s", event)
+        hooks = self.__hooks[HookType.POST_RUN].get(event.type, ())
+        for hook in hooks:
             hook(event)
 
     def __run_event(self, event):
-        self.__execute_hooks(HookType.PRE_RUN, event)
-        if self.stop_sim:
-            return
-        if event.type in [EventType.TXN_SEND, EventType.BLOCK_SEND]:
+        hooks = self.__hooks[HookType.PRE_RUN].get(event.type)
+        if hooks:
+            for hook in hooks:
+                hook(event)
+            if self.stop_sim:
+                return
+        if event.type in DEBUG_EVENT_TYPES:
             logger.debug("Running: %s", event)
-            logger.debug("Details: %s", event.description())
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Details: %s", event.description())
         else:
             logger.info("Running: %s", event)
         event.action(*event.payload)
-        self.__execute_hooks(HookType.POST_RUN, event)
+        hooks = self.__hooks[HookType.POST_RUN].get(event.type)
+        if hooks:
+            for hook in hooks:
+                hook(event)
 
-    def __run_loop(self):
-        while not self.event_queue.empty() and not self.stop_sim:
-            next_event = self.event_queue.get()
+    def __run_loop(self, predicate=None, max_events: float = float("inf")) -> int:
+        '''
+        The event loop: run events until the queue is empty, the simulation
+        is stopped, max_events ran or predicate(next event) fails.
+        Returns the number of events run.
+        '''
+        queue = self.event_queue
+        count = 0
+        while queue and not self.stop_sim and count < max_events:
+            if predicate is not None and not predicate(queue.peek()):
+                break
+            next_event = queue.pop()
             self.clock = next_event.actionable_at
             self.__run_event(next_event)
+            count += 1
+        return count
 
     def run(self):
         '''
@@ -150,5 +459,26 @@ class Simulation:
         # self.__dequeue_timer()
         self.__run_loop()
 
+    def run_until(self, time: float) -> int:
+        '''
+        Run the events scheduled before time, then advance the clock to time.
+        Events scheduled exactly at time are left for the next call.
+        Returns the number of events run.
+        '''
+        num_events = self.run_while(lambda event: event.actionable_at < time)
+        if not self.stop_sim and self.clock < time:
+            self.clock = time
+        return num_events
 
-simulation = Simulation()
+    def run_events(self, num_events: int) -> int:
+        '''
+        Run at most num_events events, returns the number of events run.
+        '''
+        return self.__run_loop(max_events=num_events)
+
+    def run_while(self, predicate) -> int:
+        '''
+        Run events as long as predicate(next event) holds, the first event
+        failing it stays queued. Returns the number of events run.
+        '''
+        return self.__run_loop(predicate)
@@ -1,10 +1,10 @@
-import random
 from typing import Union
 
 from Transaction import Transaction
 from Block import Block
-from DiscreteEventSim import simulation, Event, EventType
-from utils import expon_distribution
+from DiscreteEventSim import Simulation, Event, EventType
+from utils import set_instance_state
+from config import CONFIG
 
 
 class OneWayLINK:
@@ -13,19 +13,78 @@ class OneWayLINK:
         self.to_peer = to_peer
         self.pij = pij
         self.cij = cij
+        self.simulation: Simulation = from_peer.simulation
+        self.delivery: str = CONFIG.LINK_DELIVERY
+        # "queued" delivery: one batch of messages on the link at a time
+        self.busy_until: float = 0.0  # when the batch being sent is through
+        self.__waiting: list[Union[Transaction, Block]] = []  # queued behind it
+        self.__last_arrival: float = 0.0
+
+    def __queue_delay(self) -> float:
+        return self.simulation.streams.link.exponential((96/8)/self.cij)  # ms
 
     def __get_delay(self, message: Union[Transaction, Block]):
-        dij = expon_distribution((96/8)/self.cij)  # ms
+        dij = self.__queue_delay()
         return self.pij + message.size/self.cij + dij  # ms
 
-    def __link_delay_sim(self, message: Union[Transaction, Block]):
-        delay = self.__get_delay(message)
+    def __receive_event(self, message: Union[Transaction, Block], delay: float) -> Event:
         event_type = EventType.TXN_RECEIVE if isinstance(
             message, Transaction) else EventType.BLOCK_RECEIVE
-        event_description = f"{self.from_peer}->{self.to_peer}*; {message}; Δ:{round(delay,4)}ms"
-        new_event = Event(event_type, simulation.clock,
-                          delay, self.to_peer.receive_msg, (message, self.from_peer), event_description)
-        simulation.enqueue(new_event)
+        return Event(event_type, self.simulation.clock, delay,
+                     self.to_peer.receive_msg, (message, self.from_peer),
+                     "%s->%s*; %s; Δ:%.4fms", self.from_peer, self.to_peer, message, delay,
+                     owner=self)
+
+    def __link_delay_sim(self, message: Union[Transaction, Block]):
+        delay = self.__get_delay(message)
+        # the receive event belongs to the receiving peer's simulation
+        self.to_peer.simulation.enqueue(self.__receive_event(message, delay))
+
+    def __send_batch(self, messages: list[Union[Transaction, Block]]):
+        '''
+        Put messages on the link back to back, they arrive together once the
+        last one is through, and not before the previous batch (FIFO).
+        '''
+        clock = self.simulation.clock
+        self.busy_until = clock + sum(message.size for message in messages)/self.cij
+        arrival = max(self.busy_until + self.pij + self.__queue_delay(), self.__last_arrival)
+        self.__last_arrival = arrival
+        delay = arrival - clock
+        if len(messages) == 1:
+            new_event = self.__receive_event(messages[0], delay)
+        else:
+            new_event = Event(EventType.BATCH_RECEIVE, clock, delay,
+                              self.to_peer.receive_batch, (messages, self.from_peer),
+                              "%s->%s*; %d messages; Δ:%.4fms", self.from_peer, self.to_peer,
+                              len(messages), delay, owner=self)
+        self.to_peer.simulation.enqueue(new_event)
+
+    def __send_waiting(self):
+        messages, self.__waiting = self.__waiting, []
+        self.__send_batch(messages)
+
+    def __queue_message(self, message: Union[Transaction, Block]):
+        '''
+        Send message now if the link is free, else queue it behind the batch
+        being sent: the messages queued meanwhile go out as the next batch.
+        '''
+        clock = self.simulation.clock
+        if not self.__waiting and clock >= self.busy_until:
+            self.__send_batch([message])
+            return
+        if not self.__waiting:
+            new_event = Event(EventType.BATCH_SEND, clock, self.busy_until - clock,
+                              self.__send_waiting, (),
+                              "%s*->%s; queued batch;", self.from_peer, self.to_peer,
+                              owner=self)
+            self.simulation.enqueue(new_event)
+        self.__waiting.append(message)
+
+    def __send_event(self, event_type: EventType, message: Union[Transaction, Block]) -> Event:
+        return Event(event_type, self.simulation.clock, 0,
+                     self.__link_delay_sim, (message,),
+                     "%s*->%s; %s;", self.from_peer, self.to_peer, message,
+                     owner=self)
 
     def transmit(self, message: Union[Transaction, Block]):
         '''
@@ -33,23 +92,34 @@ class OneWayLINK:
         '''
         event_type = EventType.TXN_SEND if isinstance(
             message, Transaction) else EventType.BLOCK_SEND
-        event_description = f"{self.from_peer}*->{self.to_peer}; {message};"
-        new_event = Event(event_type, simulation.clock,
-                          0, self.__link_delay_sim, (message,), event_description)
-        simulation.enqueue(new_event)
+        if self.delivery == "send_event":
+            self.simulation.enqueue(self.__send_event(event_type, message))
+            return
+        # sending takes no simulated time, it is only traced if observed
+        if self.simulation.is_traced(event_type):
+            self.simulation.trace(self.__send_event(event_type, message))
+        if self.delivery == "queued":
+            self.__queue_message(message)
+        else:
+            self.__link_delay_sim(message)
 
     def __repr__(self) -> str:
         return f"Link({self.from_peer}->{self.to_peer})"
 
 
 class Link:
-    def __init__(self, peer1: "Peer", peer2: "Peer"):
+    def __init__(self, peer1: "Peer", peer2: "Peer", pij: float = None, cij: float = None):
         self.peer1 = peer1
         self.peer2 = peer2
-        # overall latency = ρij + |m|/cij + dij
-        self.pij = random.uniform(10, 501)  # ms
-        self.cij = 5 if peer1.is_slow_network or peer2.is_slow_network else 100  # Mbps
-        self.cij = self.cij*1024/(8*1000)  # kB/ms
+        # overall latency = ρij + |m|/cij + dij, drawn here unless given
+        # (topology.link_parameters draws them for all links at once)
+        if pij is None:
+            pij = peer1.simulation.rng.uniform(10, 501)  # ms
+        if cij is None:
+            cij = 5 if peer1.is_slow_network or peer2.is_slow_network else 100  # Mbps
+            cij = cij*1024/(8*1000)  # kB/ms
+        self.pij = pij
+        self.cij = cij
 
         self.link1 = OneWayLINK(
             from_peer=peer1, to_peer=peer2, pij=self.pij, cij=self.cij)
@@ -66,6 +136,8 @@ class Link:
     def __repr__(self):
         return f"Link({self.peer1}<->{self.peer2})"
 
+    __setstate__ = set_instance_state
+
     @ property
     def __dict__(self) -> dict:
         return {
@@ -0,0 +1,178 @@
+from bisect import bisect_left, insort
+from itertools import count
+from typing import Any
+
+from Transaction import Transaction
+from Balances import BranchBalances
+
+# dirty keys: re-evaluate a sender from its first transaction, or only if
+# its balance moved
+FROM_START = ()
+IF_MOVED = (float("inf"),)
+
+
+class Mempool:
+    '''
+    Transactions waiting to be included in a block, with the template of
+    the next block kept up to date as they come and go.
+
+    The template takes a sender's transactions in timestamp order while
+    the sender's balance at the tip covers them. Credits a sender receives
+    within the same block are not counted, so whether a transaction makes
+    it into the template depends on its sender's transactions only and a
+    change only re-evaluates the senders it touches: from the transaction
+    added or removed on, or all of a sender's transactions when its
+    balance at the tip moves.
+
+    A removed transaction is left behind in its sender's list as a dead
+    entry and the lists are compacted once half dead, so removal is O(1)
+    amortised. The template keeps, with each transaction, the balance its
+    sender has left before it. Removing the sender's oldest transaction in
+    the template (as a block on the tip does) moves the balance the
+    template starts from, and when the new tip's balance is that one
+    nothing is re-evaluated.
+    '''
+
+    def __init__(self, balances: BranchBalances):
+        self.__seq = count()
+        self.__entries: dict[Transaction, tuple] = {}  # txn -> (timestamp, seq, txn)
+        self.__by_sender: dict[Any, list[tuple]] = {}  # sender -> entries by timestamp, dead ones too
+        self.__num_dead: dict[Any, int] = {}  # sender -> dead entries in its list
+        # entry in the template -> balance its sender has left before it
+        self.__included: dict[tuple, float] = {}
+        self.__start: dict[Any, float] = {}  # sender -> balance its template starts from
+        self.__remaining: dict[Any, float] = {}  # sender -> balance left after it
+        self.__dirty: dict[Any, tuple] = {}  # sender -> first entry to re-evaluate
+        self.__balances: BranchBalances = balances
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __contains__(self, transaction: Transaction) -> bool:
+        return transaction in self.__entries
+
+    def __iter__(self):
+        return iter(self.__entries)
+
+    def __mark_dirty(self, sender: Any, key: tuple):
+        dirty = self.__dirty.get(sender)
+        if dirty is None or key < dirty:
+            self.__dirty[sender] = key
+
+    def add(self, transaction: Transaction):
+        if transaction in self.__entries:
+            return
+        entry = (transaction.timestamp, next(self.__seq), transaction)
+        self.__entries[transaction] = entry
+        sender = transaction.from_id
+        pending = self.__by_sender.get(sender)
+        if pending is None:
+            pending = self.__by_sender[sender] = []
+            self.__num_dead[sender] = 0
+            self.__start[sender] = self.__remaining[sender] = self.__balances[sender]
+        insort(pending, entry)
+        if sender in self.__dirty or pending[-1] is not entry:
+            # arrived out of order, it may take the balance of later ones
+            self.__mark_dirty(sender, entry)
+            return
+        remaining = self.__remaining[sender]
+        if remaining >= transaction.amount:
+            self.__included[entry] = remaining
+            self.__remaining[sender] = remaining - transaction.amount
+
+    def remove(self, transaction: Transaction) -> bool:
+        entry = self.__entries.pop(transaction, None)
+        if entry is None:
+            return False
+        sender = transaction.from_id
+        self.__num_dead[sender] += 1
+        before = self.__included.get(entry)
+        dirty = self.__dirty.get(sender)
+        if before is None:
+            # not in the template, the others keep their balance
+            pass
+        elif (dirty is None or entry < dirty) and before == self.__start[sender]:
+            # the sender's oldest in the template
+            del self.__included[entry]
+            self.__start[sender] = before - transaction.amount
+            self.__mark_dirty(sender, IF_MOVED)
+        else:
+            # kept until the refresh, it knows the balance before it
+            self.__mark_dirty(sender, entry)
+        if self.__dirty.get(sender, IF_MOVED) is IF_MOVED:
+            self.__compact(sender)
+        return True
+
+    def __compact(self, sender: Any):
+        '''
+        Drop the dead entries of a sender once they are half its list. None
+        of them may be in the template.
+        '''
+        pending = self.__by_sender[sender]
+        num_dead = self.__num_dead[sender]
+        if 2 * num_dead < len(pending):
+            return
+        if num_dead == len(pending):
+            del self.__by_sender[sender], self.__num_dead[sender]
+            del self.__start[sender], self.__remaining[sender]
+            return
+        entries = self.__entries
+        pending[:] = [entry for entry in pending if entries.get(entry[2]) is entry]
+        self.__num_dead[sender] = 0
+
+    def set_balances(self, balances: BranchBalances, changed: set[Any] = None):
+        '''
+        Move the template to a new tip, changed are the peers whose balance
+        differs from the previous tip (None if unknown).
+        '''
+        self.__balances = balances
+        for sender in (self.__by_sender if changed is None else changed):
+            if sender in self.__by_sender:
+                self.__mark_dirty(sender, IF_MOVED)
+
+    def __refresh(self, sender: Any, key: tuple):
+        '''
+        Re-evaluate the transactions of sender from key on.
+        '''
+        balance = self.__balances[sender]
+        if balance != self.__start[sender]:
+            self.__start[sender] = balance
+            key = FROM_START
+        pending = self.__by_sender[sender]
+        position = bisect_left(pending, key)
+        # the balance left before the first re-evaluated entry is the one
+        # saved with the next entry in the template, if any
+        remaining = None
+        included = self.__included
+        for entry in pending[position:]:
+            before = included.pop(entry, None)
+            if remaining is None:
+                remaining = before
+        if key is FROM_START:
+            remaining = balance
+        elif remaining is None:
+            remaining = self.__remaining[sender]
+        entries = self.__entries
+        for entry in pending[position:]:
+            if entries.get(entry[2]) is not entry:
+                continue
+            amount = entry[2].amount
+            if remaining >= amount:
+                included[entry] = remaining
+                remaining -= amount
+        self.__remaining[sender] = remaining
+        self.__compact(sender)
+
+    def template_size(self) -> int:
+        for sender, key in self.__dirty.items():
+            if sender in self.__by_sender:
+                self.__refresh(sender, key)
+        self.__dirty.clear()
+        return len(self.__included)
+
+    def template(self) -> list[Transaction]:
+        '''
+        Transactions of the next block, in timestamp order.
+        '''
+        self.template_size()
+        return [entry[2] for entry in sorted(self.__included)]
@@ -0,0 +1,137 @@
+from abc import ABC, abstractmethod
+from hashlib import blake2b
+from math import ceil, log
+
+from config import CONFIG
+
+
+class MessageFilter(ABC):
+    '''
+    Ids of the messages a peer already relayed, so it relays each message
+    once. Backends trade memory for how long (and how exactly) ids are
+    remembered.
+    '''
+
+    @abstractmethod
+    def __contains__(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abstractmethod
+    def add(self, key: str, time: float):
+        '''
+        Remember key, time is the simulation clock (ms).
+        '''
+
+
+class ExactSet(MessageFilter):
+    '''
+    Every id ever relayed, memory grows with the run.
+    '''
+
+    def __init__(self):
+        self.__keys: set[str] = set()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__keys
+
+    def __len__(self) -> int:
+        return len(self.__keys)
+
+    def add(self, key: str, time: float):
+        self.__keys.add(key)
+
+
+class ExpiringSet(MessageFilter):
+    '''
+    Ids relayed in the last expiry ms (up to twice that), exact. A message
+    reaches every peer within the network's diameter in delay, once it is
+    older than that no copy of it is left to suppress.
+
+    Two generations of ids: the older one is dropped as a whole when the
+    newer one has been filled for expiry ms, O(1) per message.
+    '''
+
+    def __init__(self, expiry: float = None):
+        self.expiry: float = expiry or CONFIG.MESSAGE_EXPIRY
+        self.__current: set[str] = set()
+        self.__previous: set[str] = set()
+        self.__rotated_at: float = 0.0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__current or key in self.__previous
+
+    def __len__(self) -> int:
+        return len(self.__current) + len(self.__previous)
+
+    def add(self, key: str, time: float):
+        if time - self.__rotated_at >= self.expiry:
+            if time - self.__rotated_at >= 2 * self.expiry:
+                self.__current = set()
+            self.__previous, self.__current = self.__current, set()
+            self.__rotated_at = time
+        self.__current.add(key)
+
+
+class RotatingBloomFilter(MessageFilter):
+    '''
+    Two Bloom filters of capacity ids each: when the newer one is full the
+    older one is cleared and takes the new ids. The last capacity ids (at
+    least) are remembered in a fixed amount of memory; a new message is
+    taken for a duplicate, and dropped, with probability up to about twice
+    fp_rate.
+
+    Bit positions come from blake2b rather than hash(), which is salted
+    per process and would make runs irreproducible.
+    '''
+
+    def __init__(self, capacity: int = None, fp_rate: float = None):
+        self.capacity: int = capacity or CONFIG.MESSAGE_BLOOM_CAPACITY
+        self.fp_rate: float = fp_rate or CONFIG.MESSAGE_BLOOM_FP_RATE
+        self.num_bits: int = ceil(-self.capacity * log(self.fp_rate) / log(2) ** 2)
+        self.num_hashes: int = max(1, round(self.num_bits / self.capacity * log(2)))
+        self.__current: bytearray = bytearray((self.num_bits + 7) // 8)
+        self.__previous: bytearray = bytearray((self.num_bits + 7) // 8)
+        self.__num_current: int = 0
+        self.__num_previous: int = 0
+
+    def __positions(self, key: str) -> list[int]:
+        digest = blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    @staticmethod
+    def __has(bits: bytearray, positions: list[int]) -> bool:
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def __contains__(self, key: str) -> bool:
+        positions = self.__positions(key)
+        return self.__has(self.__current, positions) or self.__has(self.__previous, positions)
+
+    def __len__(self) -> int:
+        '''
+        number of ids added to the filters in use (an upper bound on the
+        distinct ones)
+        '''
+        return self.__num_current + self.__num_previous
+
+    def add(self, key: str, time: float):
+        if self.__num_current >= self.capacity:
+            self.__previous = self.__current
+            self.__current = bytearray(len(self.__previous))
+            self.__num_previous, self.__num_current = self.__num_current, 0
+        bits = self.__current
+        for position in self.__positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.__num_current += 1
+
+
+MESSAGE_FILTERS: dict[str, type[MessageFilter]] = {
+    "set": ExactSet,
+    "expiring": ExpiringSet,
+    "bloom": RotatingBloomFilter,
+}
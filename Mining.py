@@ -0,0 +1,210 @@
+import logging
+from typing import Any
+
+from DiscreteEventSim import Simulation, Event, EventType
+
+logger = logging.getLogger(__name__)
+
+
+class FenwickTree:
+    '''
+    Prefix sums over per-slot weights with O(log n) update and search.
+    '''
+
+    def __init__(self, size: int = 1):
+        self.__weights: list[float] = []
+        self.__tree: list[float] = []
+        self.__num_updates: int = 0
+        self.__rebuild(size)
+
+    def __len__(self) -> int:
+        return len(self.__weights)
+
+    def __rebuild(self, size: int):
+        '''
+        Recompute the tree from the weights, this also drops the
+        floating point drift collected by incremental updates.
+        '''
+        weights = self.__weights + [0.0] * (size - len(self.__weights))
+        tree = [0.0] + weights
+        for i in range(1, size + 1):
+            j = i + (i & -i)
+            if j <= size:
+                tree[j] += tree[i]
+        self.__weights = weights
+        self.__tree = tree
+        self.__num_updates = 0
+
+    def __getitem__(self, index: int) -> float:
+        return self.__weights[index]
+
+    def __setitem__(self, index: int, weight: float):
+        size = len(self.__weights)
+        if index >= size:
+            self.__rebuild(max(2 * size, index + 1))
+            size = len(self.__weights)
+        delta = weight - self.__weights[index]
+        self.__weights[index] = weight
+        tree = self.__tree
+        i = index + 1
+        while i <= size:
+            tree[i] += delta
+            i += i & -i
+        self.__num_updates += 1
+        if self.__num_updates > size:
+            self.__rebuild(size)
+
+    @property
+    def total(self) -> float:
+        tree = self.__tree
+        total = 0.0
+        i = len(self.__weights)
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, value: float) -> int:
+        '''
+        Index of the slot whose cumulative weight range contains value.
+        '''
+        tree = self.__tree
+        size = len(self.__weights)
+        pos = 0
+        step = 1 << (size.bit_length() - 1)
+        while step:
+            nxt = pos + step
+            if nxt <= size and tree[nxt] <= value:
+                pos = nxt
+                value -= tree[nxt]
+            step >>= 1
+        return pos
+
+
+class MiningScheduler:
+    '''
+    Network-wide mining scheduler, an alternative to per-peer mining timers.
+
+    Every peer mining a candidate block finds it after an exponential time
+    with rate cpu_power/avg_interval_time. The minimum of independent
+    exponentials is exponential with the summed rate, and the winner is
+    miner i with probability rate_i/total. So instead of one pending event
+    per candidate, the scheduler keeps a single "next block found" event and
+    picks the winner from a Fenwick tree over the miners' rates.
+
+    Miners start and stop candidates all the time (every peer stops on each
+    new tip and starts on it a moment later), and redrawing the event on
+    every change would push two events per peer per block. Instead the
+    pending event is drawn at a bound on the total rate and thinned: when it
+    fires it is a block with probability total/bound, otherwise it is just
+    redrawn at the current total. Stopping a candidate only lowers the
+    total, so the pending event stays valid; it has to be redrawn only when
+    a start raises the total above the bound.
+    '''
+
+    def __init__(self, simulation: Simulation):
+        self.__simulation: Simulation = simulation
+        self.__slots: dict[Any, int] = {}  # miner -> slot
+        self.__miners: list[Any] = []  # slot -> miner
+        self.__candidates: list[list[Any]] = []  # slot -> blocks being mined
+        self.__rates: list[float] = []  # slot -> mining rate of one candidate
+        self.__weights = FenwickTree()
+        self.__num_candidates: int = 0
+        self.__pending = None  # handle of the next block found event
+        self.__bound: float = 0.0  # rate the pending event was drawn at
+        self.__in_callback: bool = False
+
+    def __repr__(self) -> str:
+        return "MiningScheduler"
+
+    @property
+    def simulation(self) -> Simulation:
+        return self.__simulation
+
+    def __slot(self, miner: Any, rate: float) -> int:
+        slot = self.__slots.get(miner)
+        if slot is None:
+            slot = len(self.__miners)
+            self.__slots[miner] = slot
+            self.__miners.append(miner)
+            self.__candidates.append([])
+            self.__rates.append(rate)
+        return slot
+
+    def start(self, miner: Any, block: Any, rate: float):
+        '''
+        miner starts mining block, finding it at the given rate (1/ms).
+        '''
+        slot = self.__slot(miner, rate)
+        self.__rates[slot] = rate
+        self.__candidates[slot].append(block)
+        self.__num_candidates += 1
+        self.__weights[slot] = len(self.__candidates[slot]) * rate
+        if not self.__in_callback and (self.__pending is None
+                                       or self.__weights.total > self.__bound):
+            self.__reschedule()
+
+    def stop(self, miner: Any, block: Any):
+        '''
+        miner abandons block.
+        '''
+        slot = self.__slots[miner]
+        self.__candidates[slot].remove(block)
+        self.__num_candidates -= 1
+        self.__weights[slot] = len(self.__candidates[slot]) * self.__rates[slot]
+        if not self.__num_candidates and self.__pending is not None:
+            self.__simulation.event_queue.cancel(self.__pending)
+            self.__pending = None
+
+    def __reschedule(self):
+        if self.__pending is not None:
+            # superseded, not an avoided event
+            self.__simulation.event_queue.cancel(self.__pending)
+            self.__pending = None
+        if not self.__num_candidates:
+            return
+        self.__bound = self.__weights.total
+        delay = self.__simulation.streams.mining.exponential(1/self.__bound)
+        new_event = Event(EventType.BLOCK_MINE_FINISH, self.__simulation.clock, delay,
+                          self.__block_found, (),
+                          "next block found by one of %d miners", len(self.__miners), owner=self)
+        self.__pending = self.__simulation.enqueue(new_event)
+
+    def __pick_slot(self, value: float) -> int:
+        '''
+        Slot of the miner whose weight range contains value, a uniform draw
+        below the total weight.
+        '''
+        slot = self.__weights.find(value)
+        if slot < len(self.__miners) and self.__candidates[slot]:
+            return slot
+        # rounding put us at a slot boundary, fall back to the exact weights
+        value = self.__simulation.streams.mining.random() * sum(
+            self.__weights[slot] for slot in range(len(self.__miners)))
+        for slot in range(len(self.__miners)):
+            value -= self.__weights[slot]
+            if value < 0 and self.__candidates[slot]:
+                return slot
+        return max(range(len(self.__miners)), key=lambda slot: self.__weights[slot])
+
+    def __block_found(self):
+        self.__pending = None
+        # uniform below the bound: above the total it is a rejected draw,
+        # below it picks the winner
+        value = self.__simulation.streams.mining.random() * self.__bound
+        if value >= self.__weights.total:
+            self.__reschedule()
+            return
+        slot = self.__pick_slot(value)
+        miner = self.__miners[slot]
+        block = self.__simulation.rng.choice(self.__candidates[slot])
+        logger.debug("%s <%s> %s found %s", self,
+                     EventType.BLOCK_MINE_FINISH, miner, block)
+
+        self.__in_callback = True
+        try:
+            self.stop(miner, block)
+            miner.finish_mining(block)
+        finally:
+            self.__in_callback = False
+        self.__reschedule()
@@ -0,0 +1,415 @@
+'''
+Conservative parallel discrete event simulation of the P2P network.
+
+The peers are split into partitions, every partition runs in its own worker
+process with its own event calendar. A message over a link takes at least
+pij + |m|/cij, so anything a partition sends to another one during
+[T, T + lookahead) arrives at or after T + lookahead, where lookahead is the
+smallest such bound over the links crossing partitions. The coordinator
+therefore advances all partitions in time windows of that size (YAWNS style
+barrier synchronisation), exchanging the cross-partition messages between
+windows, and skips idle stretches by starting each window at the earliest
+pending event of any partition.
+
+Every worker builds the full topology from the shared seed, so a peer index
+refers to the same peer everywhere; only the peers of its own partition get
+a block chain, the others are stand-ins (id and links) whose receive events
+go to their partition. Transactions and blocks cross process boundaries
+as plain tuples and are rebuilt once per process, keeping object identity
+(BlockChain compares blocks and transactions by identity).
+
+usage: python ParallelSim.py --workers 8 --peers 1000 --seed 1
+'''
+import argparse
+import logging
+import multiprocessing
+import random
+from itertools import count
+from time import perf_counter
+from typing import Any, Union
+
+from Block import Block, GENESIS_BLOCK
+from DiscreteEventSim import Event, EventType
+from Peer import Peer
+from RandomStreams import RandomStreams
+from Transaction import Transaction, CoinBaseTransaction
+from simulation import BlockchainSimulation
+from config import CONFIG, config_snapshot, restore_config
+
+logger = logging.getLogger(__name__)
+
+# rebuilt blocks and transactions take their ids from the wire, the id they
+# draw while being constructed is thrown away
+WIRE_RNG = random.Random(0)
+GENESIS_KEY = ("genesis",)
+# a message is at least 1 kB on the wire (Transaction.size)
+MIN_MESSAGE_SIZE = 1
+
+
+def link_lookahead(link) -> float:
+    '''
+    Lower bound of the delay of any message over link (ms).
+    '''
+    return link.pij + MIN_MESSAGE_SIZE/link.cij
+
+
+def partition_peers(peers: list[Peer], num_partitions: int) -> list[int]:
+    '''
+    Assign every peer (by index) to a partition.
+
+    Links are merged greedily from the shortest one up (Kruskal style) while
+    the merged group stays below the partition size, then the groups are
+    packed into partitions, largest first. Short links thus end up inside
+    partitions and the lookahead, bounded by the shortest link crossing
+    partitions, stays large.
+    '''
+    index = {peer: i for i, peer in enumerate(peers)}
+    capacity = -(-len(peers) // num_partitions)
+    parent = list(range(len(peers)))
+    size = [1] * len(peers)
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    edges = sorted((link_lookahead(link), index[peer], index[neighbour])
+                   for peer in peers
+                   for neighbour, link in peer.neighbours_meta.items())
+    for _, a, b in edges:
+        a, b = find(a), find(b)
+        if a != b and size[a] + size[b] <= capacity:
+            parent[b] = a
+            size[a] += size[b]
+
+    groups: dict[int, list[int]] = {}
+    for i in range(len(peers)):
+        groups.setdefault(find(i), []).append(i)
+    loads = [0] * num_partitions
+    partition_of = [0] * len(peers)
+    for group in sorted(groups.values(), key=len, reverse=True):
+        partition = min(range(num_partitions), key=loads.__getitem__)
+        loads[partition] += len(group)
+        for i in group:
+            partition_of[i] = partition
+    return partition_of
+
+
+def partition_lookahead(peers: list[Peer], partition_of: list[int]) -> float:
+    '''
+    Smallest delay bound over the links crossing partitions.
+    '''
+    index = {peer: i for i, peer in enumerate(peers)}
+    return min((link_lookahead(link)
+                for peer in peers
+                for neighbour, link in peer.neighbours_meta.items()
+                if partition_of[index[peer]] != partition_of[index[neighbour]]),
+               default=float("inf"))
+
+
+class WireCodec:
+    '''
+    Turns transactions and blocks into picklable tuples and back.
+
+    Objects are keyed by (origin partition, serial) the first time they
+    leave the process that created them; a process keeps one object per key,
+    and blocks are sent along with the ancestors the destination partition
+    has not been sent yet, so prev_block can always be resolved.
+    '''
+
+    def __init__(self, partition: int, peers: list[Peer]):
+        self.__partition = partition
+        self.__peers = peers
+        self.__peer_index = {peer: i for i, peer in enumerate(peers)}
+        self.__serial = count()
+        self.__keys: dict[Any, tuple] = {GENESIS_BLOCK: GENESIS_KEY}
+        self.__objects: dict[tuple, Any] = {GENESIS_KEY: GENESIS_BLOCK}
+        self.__shipped: dict[int, set[tuple]] = {}  # partition -> block keys
+
+    def __key(self, obj: Any) -> tuple:
+        key = self.__keys.get(obj)
+        if key is None:
+            key = (self.__partition, next(self.__serial))
+            self.__keys[obj] = key
+            self.__objects[key] = obj
+        return key
+
+    def __peer(self, peer: Peer) -> int:
+        return None if peer is None else self.__peer_index[peer]
+
+    def __encode_txn(self, txn: Transaction) -> tuple:
+        return (self.__key(txn), isinstance(txn, CoinBaseTransaction), txn.txn_id,
+                self.__peer(txn.from_id), self.__peer(txn.to_id), txn.amount, txn.timestamp)
+
+    def __encode_block(self, block: Block) -> tuple:
+        return (self.__key(block), self.__key(block.prev_block), block.block_id,
+                self.__peer(block.miner), block.timestamp,
+                [self.__encode_txn(txn) for txn in block.transactions])
+
+    def encode(self, msg: Union[Transaction, Block], partition: int) -> tuple:
+        if isinstance(msg, Transaction):
+            return ("txn", self.__encode_txn(msg))
+        shipped = self.__shipped.setdefault(partition, {GENESIS_KEY})
+        chain = []
+        block = msg
+        while self.__key(block) not in shipped:
+            chain.append(block)
+            shipped.add(self.__key(block))
+            block = block.prev_block
+        return ("block", (self.__key(msg),
+                          [self.__encode_block(block) for block in reversed(chain)]))
+
+    def __decode_txn(self, record: tuple) -> Transaction:
+        key, is_coinbase, txn_id, from_index, to_index, amount, timestamp = record
+        txn = self.__objects.get(key)
+        if txn is None:
+            to_peer = self.__peers[to_index]
+            if is_coinbase:
+                txn = CoinBaseTransaction(to_peer, timestamp, WIRE_RNG)
+            else:
+                txn = Transaction(self.__peers[from_index], to_peer,
+                                  amount, timestamp, WIRE_RNG)
+            txn.txn_id = txn_id
+            self.__keys[txn] = key
+            self.__objects[key] = txn
+        return txn
+
+    def __decode_block(self, record: tuple) -> Block:
+        key, prev_key, block_id, miner_index, timestamp, txns = record
+        block = self.__objects.get(key)
+        if block is None:
+            block = Block(self.__objects[prev_key],
+                          [self.__decode_txn(txn) for txn in txns],
+                          self.__peers[miner_index], timestamp, WIRE_RNG)
+            block.block_id = block_id
+            self.__keys[block] = key
+            self.__objects[key] = block
+        return block
+
+    def decode(self, payload: tuple) -> Union[Transaction, Block]:
+        kind, data = payload
+        if kind == "txn":
+            return self.__decode_txn(data)
+        key, records = data
+        for record in records:
+            self.__decode_block(record)
+        return self.__objects[key]
+
+
+class RemotePeerMailbox:
+    '''
+    Stands in for the Simulation of a peer owned by another partition:
+    receive events scheduled for that peer are sent to its partition.
+    '''
+
+    def __init__(self, partition: "PartitionSimulation", peer: Peer):
+        self.__partition = partition
+        self.__peer = peer
+
+    def enqueue(self, event: Event):
+        messages, source = event.payload
+        if event.type is not EventType.BATCH_RECEIVE:
+            messages = (messages,)
+        for message in messages:
+            self.__partition.send(event.actionable_at, self.__peer, source, message)
+
+
+class PartitionSimulation(BlockchainSimulation):
+    '''
+    The part of the network owned by one worker process.
+    '''
+
+    def __init__(self, seed, partition: int, partition_of: list[int]):
+        super().__init__(seed=seed, show_progress=False)
+        self.partition = partition
+        self.partition_of = partition_of
+        self.outbox: list[tuple] = []
+
+    def setup(self):
+        local = {i for i, partition in enumerate(self.partition_of)
+                 if partition == self.partition}
+        # block chains for the local peers only, the others are stand-ins
+        self.peers_network = self.create_network(local)
+        self.local_peers = [peer for i, peer in enumerate(self.peers_network)
+                            if i in local]
+        # only the local share of the transactions is counted here
+        self.block_trigger_txns *= len(self.local_peers)/len(self.peers_network)
+        self.peer_index = {peer: i for i, peer in enumerate(self.peers_network)}
+        self.codec = WireCodec(self.partition, self.peers_network)
+        self.schedule_transactions()
+        for i, peer in enumerate(self.peers_network):
+            if self.partition_of[i] != self.partition:
+                peer.simulation = RemotePeerMailbox(self, peer)
+        # the network and workload are shared, the rest of the run is drawn
+        # from a stream of this partition
+        self.simulation.rng.seed(f"{self.seed}/{self.partition}")
+        self.simulation.streams = RandomStreams(f"{self.seed}/{self.partition}")
+        self.add_simulation_hooks()
+        self.setup_progressbars()
+
+    def post_block_broadcast_hooks(self, event):
+        # termination is decided by the coordinator on the global count
+        self.blocks_broadcasted += 1
+
+    def send(self, arrival: float, to_peer: Peer, from_peer: Peer, message: Union[Transaction, Block]):
+        to_index = self.peer_index[to_peer]
+        self.outbox.append((arrival, to_index, self.peer_index[from_peer],
+                            self.codec.encode(message, self.partition_of[to_index])))
+
+    def __receive(self, arrival: float, to_index: int, from_index: int, message: Union[Transaction, Block]):
+        to_peer, from_peer = self.peers_network[to_index], self.peers_network[from_index]
+        event_type = EventType.TXN_RECEIVE if isinstance(
+            message, Transaction) else EventType.BLOCK_RECEIVE
+        clock = self.simulation.clock
+        new_event = Event(event_type, clock, arrival - clock,
+                          to_peer.receive_msg, (message, from_peer),
+                          "%s->%s*; %s; remote", from_peer, to_peer, message,
+                          owner=from_peer.neighbours_meta[to_peer])
+        self.simulation.enqueue(new_event)
+
+    def run_window(self, end: float, incoming: list[tuple]) -> tuple:
+        '''
+        Take in the messages of other partitions and run up to end.
+        Returns the outgoing messages, the time of the next pending event
+        and the number of blocks broadcasted so far.
+        '''
+        # decode in the order of sending, a block's ancestors are only
+        # shipped with the first message that needs them
+        incoming = [(arrival, to_index, from_index, self.codec.decode(payload))
+                    for arrival, to_index, from_index, payload in incoming]
+        for message in sorted(incoming, key=lambda message: message[0]):
+            self.__receive(*message)
+        self.simulation.run_until(end)
+        outgoing, self.outbox = self.outbox, []
+        queue = self.simulation.event_queue
+        next_time = queue.peek().actionable_at if queue else None
+        return outgoing, next_time, self.blocks_broadcasted
+
+    def results(self) -> list[tuple[int, dict]]:
+        return [(self.peer_index[peer], peer.__dict__) for peer in self.local_peers]
+
+
+def worker_main(conn, config: dict, seed, partition: int, partition_of: list[int]):
+    restore_config(config)
+    partition_sim = PartitionSimulation(seed, partition, partition_of)
+    partition_sim.setup()
+    while True:
+        command, *args = conn.recv()
+        if command == "window":
+            conn.send(partition_sim.run_window(*args))
+        elif command == "results":
+            conn.send(partition_sim.results())
+            break
+    conn.close()
+
+
+class ParallelSimulation:
+    '''
+    Runs the network simulation over num_workers worker processes.
+
+    Runs are reproducible for a fixed seed and number of workers. With a
+    single worker the run is the sequential BlockchainSimulation with the
+    same seed, event for event. Differences to the sequential model: the
+    "create block" trigger counts the transactions of its partition only
+    (with the threshold scaled to the partition's share of the peers), the
+    partitions draw from their own random streams after the setup, and the
+    run stops at the end of the window in which the network-wide block
+    count passes the target.
+    '''
+
+    def __init__(self, num_workers: int, seed=None):
+        self.num_workers = num_workers
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        self.num_windows = 0
+        self.blocks_broadcasted = 0
+        self.lookahead = float("inf")
+
+    def __run_sequential(self) -> list[dict]:
+        run = BlockchainSimulation(seed=self.seed, show_progress=False)
+        run.setup()
+        run.run()
+        self.blocks_broadcasted = run.blocks_broadcasted
+        return [peer.__dict__ for peer in run.peers_network]
+
+    def run(self) -> list[dict]:
+        '''
+        Run to the end, returns the exported peers in network order.
+        '''
+        if self.num_workers == 1:
+            return self.__run_sequential()
+
+        layout = BlockchainSimulation(seed=self.seed, show_progress=False)
+        peers = layout.create_network(local=())
+        partition_of = partition_peers(peers, self.num_workers)
+        self.lookahead = partition_lookahead(peers, partition_of)
+        logger.info("partitions: %d lookahead: %.3fms",
+                    self.num_workers, self.lookahead)
+        del layout, peers
+
+        conns, workers = [], []
+        for partition in range(self.num_workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=worker_main,
+                args=(child_conn, config_snapshot(), self.seed, partition, partition_of))
+            worker.start()
+            child_conn.close()
+            conns.append(parent_conn)
+            workers.append(worker)
+
+        try:
+            self.__run_windows(conns, partition_of)
+            results = []
+            for conn in conns:
+                conn.send(("results",))
+                results.extend(conn.recv())
+        finally:
+            for worker in workers:
+                worker.join()
+        return [peer for _, peer in sorted(results, key=lambda result: result[0])]
+
+    def __run_windows(self, conns: list, partition_of: list[int]):
+        next_times = [0.0] * self.num_workers
+        inboxes = [[] for _ in range(self.num_workers)]
+        while True:
+            pending = [time for time in next_times if time is not None]
+            pending += [message[0] for inbox in inboxes for message in inbox]
+            if not pending:
+                break
+            end = min(pending) + self.lookahead
+            for conn, inbox in zip(conns, inboxes):
+                conn.send(("window", end, inbox))
+            inboxes = [[] for _ in range(self.num_workers)]
+            self.blocks_broadcasted = 0
+            for partition, conn in enumerate(conns):
+                outgoing, next_times[partition], blocks = conn.recv()
+                self.blocks_broadcasted += blocks
+                for message in outgoing:
+                    inboxes[partition_of[message[1]]].append(message)
+            self.num_windows += 1
+            if self.blocks_broadcasted > CONFIG.TOTAL_NUM_BLOCKS + 5:
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--peers", type=int, default=CONFIG.NUMBER_OF_PEERS)
+    parser.add_argument("--seed", type=int, default=CONFIG.SEED)
+    args = parser.parse_args()
+    CONFIG.NUMBER_OF_PEERS = args.peers
+
+    parallel_sim = ParallelSimulation(args.workers, seed=args.seed)
+    start = perf_counter()
+    peers = parallel_sim.run()
+    elapsed = perf_counter() - start
+    print(f"{len(peers)} peers, {parallel_sim.num_workers} workers, "
+          f"lookahead {parallel_sim.lookahead:.2f}ms, {parallel_sim.num_windows} windows")
+    print(f"blocks broadcasted: {parallel_sim.blocks_broadcasted}, "
+          f"elapsed: {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
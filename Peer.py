@@ -1,14 +1,15 @@
-import random
 import logging
 from copy import deepcopy
 from typing import Union
 
 from Transaction import Transaction
 from Block import Block
-from utils import expon_distribution, generate_random_id
-from Block import BlockChain
-from DiscreteEventSim import simulation, Event, EventType
+from utils import expon_distribution, generate_random_id, set_instance_state
+from Block import BlockChain, BlockStore
+from DiscreteEventSim import Simulation, Event, EventType
+from Mining import MiningScheduler
 from Link import Link
+from MessageFilter import MessageFilter, MESSAGE_FILTERS
 
 from config import CONFIG
 
@@ -17,9 +18,10 @@ logger = logging.getLogger(__name__)
 
 class Peer:
 
-    def __init__(self, id, is_slow_network=False, is_slow_cpu=False):
+    def __init__(self, id, simulation: Simulation, is_slow_network=False, is_slow_cpu=False):
         # self.id: int = id
-        self.id: str = generate_random_id(3)
+        self.simulation: Simulation = simulation
+        self.id: str = generate_random_id(3, simulation.rng)
         self.is_slow_network: float = is_slow_network
         self.is_slow_cpu: float = is_slow_cpu
         self.crypto_coins: int = CONFIG.INITIAL_COINS
@@ -27,7 +29,8 @@ class Peer:
         self.neighbours_meta: dict["Peer", Link] = {}
         self.cpu_power: float = self.__calculate_cpu_power()
 
-        self.forwarded_messages: set[Union[Transaction, Block]] = set()
+        # ids of the messages relayed so far
+        self.forwarded_messages: MessageFilter = MESSAGE_FILTERS[CONFIG.MESSAGE_FILTER]()
 
     @property
     def cpu_net_description(self):
@@ -46,11 +49,15 @@ class Peer:
         high_cpu_power = round(10*low_cpu_power, 4)
         return low_cpu_power if self.is_slow_cpu else high_cpu_power
 
-    def init_blockchain(self, peers: list["Peer"]):
-        self.block_chain = BlockChain(cpu_power=self.cpu_power,
+    def init_blockchain(self, peers: list["Peer"], mining_scheduler: MiningScheduler = None,
+                        block_store: BlockStore = None):
+        self.block_chain = BlockChain(simulation=self.simulation,
+                                      cpu_power=self.cpu_power,
                                       broadcast_block_function=self.broadcast_block,
                                       peers=peers,
-                                      owner_peer=self)
+                                      owner_peer=self,
+                                      mining_scheduler=mining_scheduler,
+                                      block_store=block_store)
 
     def connect(self, peer: "Peer", link: Link):
         # self.connected_peers.append(peer)
@@ -61,6 +68,8 @@ class Peer:
         # self.connected_peers.remove(peer)
         self.neighbours.pop(peer)
 
+    __setstate__ = set_instance_state
+
     @ property
     def __dict__(self) -> dict:
         return ({
@@ -88,7 +97,7 @@ class Peer:
         '''
         Forward a message to given peers.
         '''
-        self.forwarded_messages.add(msg.id)
+        self.forwarded_messages.add(msg.id, self.simulation.clock)
 
         for peer in peers:
             self.__forward_msg_to_peer(msg, peer)
@@ -98,10 +107,11 @@ class Peer:
         return list(self.neighbours.keys())
 
     def __create_txn(self, timestamp):
-        to_peer = random.choice(self.connected_peers)
-        amount = random.uniform(0, self.crypto_coins)
+        workload = self.simulation.streams.workload
+        to_peer = workload.choice(self.connected_peers)
+        amount = workload.uniform(0, self.crypto_coins)
         self.crypto_coins -= amount
-        return Transaction(self, to_peer, amount, timestamp)
+        return Transaction(self, to_peer, amount, timestamp, self.simulation.rng)
 
     def generate_random_txn(self, timestamp):
         '''
@@ -110,10 +120,10 @@ class Peer:
         # timestamp = simulation.clock
         new_txn = self.__create_txn(timestamp)
         self.block_chain.add_transaction(new_txn)
-        new_txn_event_description = f"{self.id}->*; {new_txn};"
         new_txn_event = Event(EventType.TXN_BROADCAST, timestamp,
-                              timestamp, self.broadcast_txn, (new_txn,), new_txn_event_description)
-        simulation.enqueue(new_txn_event)
+                              timestamp, self.broadcast_txn, (new_txn,),
+                              "%s->*; %s;", self.id, new_txn, owner=self)
+        self.simulation.enqueue(new_txn_event)
 
     def receive_msg(self, msg: Union[Transaction, Block], source: "Peer"):
         '''
@@ -133,6 +143,13 @@ class Peer:
         self.__forward_msg_to_peers(
             msg, list(filter(lambda x: x != source, self.connected_peers)))
 
+    def receive_batch(self, messages: list[Union[Transaction, Block]], source: "Peer"):
+        '''
+        Receive messages which arrived together over one link, in order.
+        '''
+        for msg in messages:
+            self.receive_msg(msg, source)
+
     def broadcast_msg(self, msg: Union[Transaction, Block]):
         '''
         Broadcast a message to all connected peers.
@@ -0,0 +1,77 @@
+import hashlib
+from typing import Any, Sequence
+
+import numpy as np
+
+# variates drawn at a time per stream and distribution
+BLOCK_SIZE = 1 << 16
+
+
+def seed_entropy(seed: Any) -> int:
+    '''
+    Entropy of a SeedSequence for seed: non-negative ints as they are,
+    negative ones modulo 2**128, other seeds (e.g. the "<seed>/<partition>"
+    strings of ParallelSim) by their sha256, None for fresh entropy from the
+    OS.
+    '''
+    if seed is None:
+        return seed
+    if isinstance(seed, int):
+        # SeedSequence takes non-negative ints only
+        return seed if seed >= 0 else seed % 2**128
+    return int.from_bytes(hashlib.sha256(str(seed).encode()).digest(), "little")
+
+
+class RandomStream:
+    '''
+    Variates of one purpose from its own NumPy generator, drawn block_size
+    at a time when the previous block is used up and handed out one by one.
+    '''
+
+    def __init__(self, seed_sequence: np.random.SeedSequence, block_size: int = BLOCK_SIZE):
+        self.block_size: int = block_size
+        self.__generator = np.random.Generator(np.random.PCG64(seed_sequence))
+        # handed out from the end
+        self.__exponential: list[float] = []
+        self.__uniform: list[float] = []
+
+    def exponential(self, mean: float) -> float:
+        buffer = self.__exponential
+        if not buffer:
+            buffer = self.__exponential = self.__generator.standard_exponential(
+                self.block_size).tolist()
+        return buffer.pop() * mean
+
+    def random(self) -> float:
+        '''
+        uniform in [0, 1)
+        '''
+        buffer = self.__uniform
+        if not buffer:
+            buffer = self.__uniform = self.__generator.random(self.block_size).tolist()
+        return buffer.pop()
+
+    def uniform(self, low: float, high: float) -> float:
+        return low + (high - low) * self.random()
+
+    def choice(self, seq: Sequence) -> Any:
+        # the product can round up to len(seq) for long sequences
+        return seq[min(int(self.random() * len(seq)), len(seq) - 1)]
+
+
+class RandomStreams:
+    '''
+    Independent streams per purpose, all derived from one seed: the
+    streams of a purpose don't shift when another purpose draws more or
+    fewer variates.
+    '''
+    PURPOSES = ("link", "mining", "workload")
+
+    def __init__(self, seed: Any = None, block_size: int = BLOCK_SIZE):
+        seed_sequences = np.random.SeedSequence(seed_entropy(seed)).spawn(len(self.PURPOSES))
+        # queueing delays of the links
+        self.link: RandomStream = RandomStream(seed_sequences[0], block_size)
+        # time to mine a block, which miner finds it
+        self.mining: RandomStream = RandomStream(seed_sequences[1], block_size)
+        # when transactions are created, by whom, to whom and how much
+        self.workload: RandomStream = RandomStream(seed_sequences[2], block_size)
@@ -0,0 +1,522 @@
+'''
+Micro benchmarks for the simulator internals.
+
+usage: python benchmarks.py <benchmark> [options]
+'''
+import argparse
+import random
+import tracemalloc
+from queue import PriorityQueue
+from time import perf_counter
+
+from DiscreteEventSim import Event, EventType, EVENT_QUEUE_BACKENDS, Simulation
+from Mining import MiningScheduler
+from utils import expon_distribution
+
+
+def _hold_events(num_events: int, mean_delay: float) -> list[Event]:
+    '''
+    Events spread over time the way the simulator spreads them
+    (exponential inter-event times).
+    '''
+    events = []
+    time = 0.0
+    for _ in range(num_events):
+        time += random.expovariate(1/mean_delay)
+        events.append(Event(EventType.TXN_CREATE, time, 0, None, ()))
+    return events
+
+
+def _hold_priority_queue(events: list[Event], num_ops: int, mean_delay: float) -> float:
+    queue = PriorityQueue()
+    for event in events:
+        queue.put(event)
+    start = perf_counter()
+    for _ in range(num_ops):
+        event = queue.get()
+        event.actionable_at += random.expovariate(1/mean_delay)
+        queue.put(event)
+    return perf_counter() - start
+
+
+def _hold_event_queue(backend: str):
+    def hold(events: list[Event], num_ops: int, mean_delay: float) -> float:
+        queue = EVENT_QUEUE_BACKENDS[backend]()
+        for event in events:
+            queue.push(event)
+        start = perf_counter()
+        for _ in range(num_ops):
+            event = queue.pop()
+            event.actionable_at += random.expovariate(1/mean_delay)
+            queue.push(event)
+        return perf_counter() - start
+    return hold
+
+
+def bench_event_queue(args):
+    '''
+    Classic "hold" benchmark: with `pending` events in the queue, repeatedly
+    pop the next event and schedule it again a random delay later.
+    '''
+    mean_delay = 10*1000
+    print(f"building {args.pending:,} pending events")
+    events = _hold_events(args.pending, mean_delay)
+    backends = {"queue.PriorityQueue": _hold_priority_queue}
+    for backend in EVENT_QUEUE_BACKENDS:
+        backends[backend] = _hold_event_queue(backend)
+    for name, hold in backends.items():
+        # every backend starts from the same schedule
+        for event in events:
+            event.actionable_at = event.created_at
+        random.seed(args.seed)
+        elapsed = hold(events, args.ops, mean_delay)
+        print(f"{name.rjust(25)}: {args.ops/elapsed:,.0f} events/sec")
+
+
+class _RoundMiner:
+    '''
+    Stand-in for BlockChain: every found block starts a new round in which
+    all miners restart on the new tip.
+    '''
+
+    def __init__(self, scheduler: MiningScheduler, rate: float, rounds: list, num_rounds: int):
+        self.scheduler = scheduler
+        self.rate = rate
+        self.rounds = rounds
+        self.num_rounds = num_rounds
+        self.miners = []
+        self.block = None
+
+    def __repr__(self) -> str:
+        return f"Miner(rate={self.rate})"
+
+    def restart(self, tip):
+        if self.block is not None:
+            self.scheduler.stop(self, self.block)
+        self.block = (tip, self)
+        self.scheduler.start(self, self.block, self.rate)
+
+    def finish_mining(self, block):
+        self.block = None
+        self.rounds.append((self, self.scheduler.simulation.clock))
+        if len(self.rounds) >= self.num_rounds:
+            self.scheduler.simulation.stop_sim = True
+            return
+        for miner in self.miners:
+            miner.restart(len(self.rounds))
+
+
+def bench_mining_equivalence(args):
+    '''
+    Check that the global mining scheduler is statistically equivalent to
+    per-peer exponential timers: same block interval distribution and the
+    same share of blocks per miner (chi-square test at 99.9%).
+    '''
+    num_peers, avg_interval = 20, 1000*1000
+    num_rounds = args.ops // 10
+    # cpu powers as Peer computes them, 80% slow miners
+    low = round(1/((10-9*0.8)*num_peers), 4)
+    cpu_powers = [low]*16 + [10*low]*4
+    rates = [cpu_power/avg_interval for cpu_power in cpu_powers]
+
+    # per-peer timers, as BlockChain.__mine_block_start draws them
+    per_peer_wins = [0]*num_peers
+    per_peer_intervals = []
+    for _ in range(num_rounds):
+        delays = [expon_distribution(avg_interval/cpu_power)
+                  for cpu_power in cpu_powers]
+        winner = min(range(num_peers), key=delays.__getitem__)
+        per_peer_wins[winner] += 1
+        per_peer_intervals.append(delays[winner])
+
+    # global scheduler
+    rounds = []
+    simulation = Simulation(seed=args.seed)
+    scheduler = MiningScheduler(simulation)
+    miners = [_RoundMiner(scheduler, rate, rounds, num_rounds) for rate in rates]
+    for miner in miners:
+        miner.miners = miners
+        miner.restart(0)
+    simulation.run()
+    global_wins = [0]*num_peers
+    global_intervals = []
+    last_time = 0.0
+    for miner, time in rounds:
+        global_wins[miners.index(miner)] += 1
+        global_intervals.append(time - last_time)
+        last_time = time
+
+    expected_interval = 1/sum(rates)
+    for name, intervals in (("per_peer", per_peer_intervals), ("global", global_intervals)):
+        mean = sum(intervals)/len(intervals)
+        print(f"{name.rjust(10)}: mean interval {mean:,.0f}ms "
+              f"(expected {expected_interval:,.0f}ms)")
+
+    # two sample chi-square test on the number of blocks won per miner
+    chi2 = 0.0
+    for a, b in zip(per_peer_wins, global_wins):
+        if a + b:
+            chi2 += (a - b)**2 / (a + b)
+    dof = num_peers - 1
+    # Wilson-Hilferty approximation of the 99.9% chi-square quantile
+    critical = dof * (1 - 2/(9*dof) + 3.09*(2/(9*dof))**0.5)**3
+    print(f"chi-square of blocks per miner: {chi2:.2f} (99.9% critical {critical:.2f})")
+    # standard error of the difference of the interval means
+    diff = abs(sum(per_peer_intervals)/num_rounds - sum(global_intervals)/num_rounds)
+    print(f"interval mean difference: {diff/expected_interval*100:.2f}% of the mean")
+    equivalent = chi2 < critical and diff < 4*expected_interval*(2/num_rounds)**0.5
+    print("equivalent" if equivalent else "NOT equivalent")
+    if not equivalent:
+        raise SystemExit(1)
+
+
+def _block_chain_with(num_blocks: int, peers: list, rng: random.Random):
+    '''
+    A BlockChain holding num_blocks empty blocks, mostly one chain with
+    a fork every few blocks. Returns the chain and its blocks.
+    '''
+    from Block import Block, BlockChain, GENESIS_BLOCK
+
+    simulation = Simulation(seed=rng.random())
+    block_chain = BlockChain(simulation, 1.0, None, peers, peers[0])
+    blocks = [GENESIS_BLOCK]
+    for _ in range(num_blocks):
+        prev_block = blocks[-1] if rng.random() < 0.9 else rng.choice(blocks[-5:])
+        block = Block(prev_block, [], rng.choice(peers), simulation.clock, rng)
+        block_chain.add_block(block)
+        blocks.append(block)
+    return block_chain, blocks
+
+
+def bench_add_block(args):
+    '''
+    Cost of BlockChain.add_block against the number of blocks it holds.
+    '''
+    from Block import Block
+
+    rng = random.Random(args.seed)
+    peers = [f"peer{i}" for i in range(10)]
+    num_added = 1000
+    for num_blocks in (10**3, 10**4, 10**5):
+        block_chain, blocks = _block_chain_with(num_blocks, peers, rng)
+        new_blocks = []
+        prev_block = blocks[-1]
+        for _ in range(num_added):
+            prev_block = Block(prev_block, [], rng.choice(peers), 0, rng)
+            new_blocks.append(prev_block)
+        start = perf_counter()
+        for block in new_blocks:
+            block_chain.add_block(block)
+        elapsed = perf_counter() - start
+        print(f"{num_blocks:>8,} blocks held: {elapsed/num_added*1e6:9.2f} us/add_block")
+
+
+def _random_transactions(peers: list, num_txns: int, rng: random.Random) -> list:
+    from Transaction import Transaction
+
+    return [Transaction(*rng.sample(peers, 2), rng.uniform(0, 1), 0, rng)
+            for _ in range(num_txns)]
+
+
+def bench_balances(args):
+    '''
+    Memory held by the per-block balances of one chain at 1000 peers, a
+    dict copy per block against persistent BranchBalances, and the cost of
+    a balance lookup.
+    '''
+    from Balances import BranchBalances
+
+    rng = random.Random(args.seed)
+    num_peers, num_blocks, txns_per_block = 1000, 300, 100
+    peers = [f"peer{i}" for i in range(num_peers)]
+    blocks = [_random_transactions(peers, txns_per_block, rng)
+              for _ in range(num_blocks)]
+    print(f"{num_peers:,} peers, {num_blocks} blocks of {txns_per_block} txns")
+
+    def dict_copies():
+        balances = [dict.fromkeys(peers, 1000.0)]
+        for transactions in blocks:
+            balances_upto_block = balances[-1].copy()
+            for transaction in transactions:
+                balances_upto_block[transaction.from_id] -= transaction.amount
+                balances_upto_block[transaction.to_id] += transaction.amount
+            balances.append(balances_upto_block)
+        return balances
+
+    def branch_balances():
+        balances = [BranchBalances.initial(dict.fromkeys(peers, 1000.0))]
+        for transactions in blocks:
+            balances.append(balances[-1].after(transactions))
+        return balances
+
+    for name, build in (("dict copy", dict_copies), ("persistent", branch_balances)):
+        tracemalloc.start()
+        balances = build()
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        lookups = [rng.choice(peers) for _ in range(args.ops // 10)]
+        start = perf_counter()
+        for i, peer in enumerate(lookups):
+            balances[i % len(balances)][peer]
+        elapsed = perf_counter() - start
+        print(f"{name.rjust(10)}: {memory/2**20:8.2f} MiB  "
+              f"{memory/len(balances)/1024:7.2f} KiB/block  "
+              f"lookup {elapsed/len(lookups)*1e9:6.0f} ns")
+
+
+def _gossip_arrivals(num_messages: int, rng: random.Random) -> list[tuple[float, str]]:
+    '''
+    What one peer receives: new messages every 100ms on average, each
+    arriving once per neighbour (4 to 6) within 2.5s of the first copy.
+    '''
+    arrivals = []
+    time = 0.0
+    for i in range(num_messages):
+        time += rng.expovariate(1/100)
+        key = f"msg{i}"
+        for _ in range(rng.randint(4, 6)):
+            arrivals.append((time + rng.uniform(0, 2500), key))
+    arrivals.sort()
+    return arrivals
+
+
+def bench_mempool(args):
+    '''
+    Cost of a new tip for the mempool against the number of transactions
+    pending: removing the block's transactions, moving to its balances and
+    refreshing the template. The block takes the oldest transactions of the
+    template, or random ones.
+    '''
+    from Balances import BranchBalances
+    from Mempool import Mempool
+    from Transaction import Transaction
+
+    rng = random.Random(args.seed)
+    senders = [f"peer{i}" for i in range(10)]
+    num_blocks, txns_per_block = 100, 100
+    picks = {
+        "oldest": lambda mempool: mempool.template()[:txns_per_block],
+        "random": lambda mempool: rng.sample(list(mempool), txns_per_block),
+    }
+    for num_pending in (10**3, 10**4, 10**5):
+        for name, pick in picks.items():
+            # the senders afford all their transactions, the receiver sends none
+            balances = BranchBalances.initial(dict.fromkeys(senders + ["receiver"], float(num_pending)))
+            mempool = Mempool(balances)
+            transactions = [Transaction(rng.choice(senders), "receiver", rng.uniform(0, 1), time, rng)
+                            for time in range(num_pending + num_blocks*txns_per_block)]
+            for transaction in transactions[:num_pending]:
+                mempool.add(transaction)
+            arriving = iter(transactions[num_pending:])
+            elapsed = 0.0
+            for _ in range(num_blocks):
+                block = pick(mempool)
+                start = perf_counter()
+                for transaction in block:
+                    mempool.remove(transaction)
+                balances = balances.after(block)
+                mempool.set_balances(balances, {transaction.from_id for transaction in block})
+                mempool.template_size()
+                elapsed += perf_counter() - start
+                # as many arrive, the mempool keeps its size
+                for _ in range(txns_per_block):
+                    mempool.add(next(arriving))
+            print(f"{num_pending:>8,} pending, {name} block: {elapsed/num_blocks*1e6:9.2f} us/tip")
+
+
+def bench_dedup(args):
+    '''
+    Memory of the message de-duplication backends against how well they
+    suppress duplicates: duplicates let through and new messages dropped
+    as duplicates (Bloom false positives).
+    '''
+    from MessageFilter import MESSAGE_FILTERS
+
+    rng = random.Random(args.seed)
+    num_messages = args.ops // 10
+    arrivals = _gossip_arrivals(num_messages, rng)
+    print(f"{num_messages:,} messages over {arrivals[-1][0]/1000:,.0f}s, "
+          f"{len(arrivals):,} arrivals")
+    for name, message_filter_type in MESSAGE_FILTERS.items():
+        message_filter = message_filter_type()
+        relayed, dropped = set(), set()
+        missed = 0
+        start = perf_counter()
+        for time, key in arrivals:
+            if key in message_filter:
+                if key not in relayed:
+                    dropped.add(key)
+                continue
+            missed += key in relayed
+            relayed.add(key)
+            message_filter.add(key, time)
+        elapsed = perf_counter() - start
+
+        # memory of the filter alone, in a second pass
+        tracemalloc.start()
+        message_filter = message_filter_type()
+        for time, key in arrivals:
+            if key not in message_filter:
+                message_filter.add(key, time)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name.rjust(9)}: {memory/2**20:8.2f} MiB  "
+              f"{elapsed/len(arrivals)*1e9:6.0f} ns/msg  "
+              f"duplicates let through {missed:,}  new messages dropped {len(dropped):,}")
+
+
+def bench_link_delivery(args):
+    '''
+    Events run and wall time of the default scenario with a send event per
+    hop, scheduling the arrival directly, and queueing on the links (batches
+    of queued messages arrive in one event).
+    '''
+    from simulation import BlockchainSimulation
+    from config import CONFIG
+
+    CONFIG.TOTAL_NUM_BLOCKS = args.blocks
+    CONFIG.TOTAL_NUM_TRANSACTIONS = args.blocks*CONFIG.TXN_PER_BLOCK
+    print(f"{CONFIG.NUMBER_OF_PEERS:,} peers, {CONFIG.TOTAL_NUM_TRANSACTIONS:,} transactions")
+    for delivery in ("send_event", "direct", "queued"):
+        CONFIG.LINK_DELIVERY = delivery
+        run = BlockchainSimulation(seed=args.seed, show_progress=False)
+        run.setup()
+        start = perf_counter()
+        num_events = run.run_while(lambda run: True)
+        elapsed = perf_counter() - start
+        print(f"{delivery.rjust(10)}: {num_events:>10,} events  {elapsed:8.2f}s  "
+              f"{elapsed/num_events*1e6:6.2f} us/event  blocks {run.blocks_broadcasted}")
+
+
+def bench_mining_modes(args):
+    '''
+    Mining events pushed, events run and wall time of the default scenario
+    on --peers peers with per-peer mining timers and the global scheduler.
+    '''
+    from simulation import BlockchainSimulation
+    from DiscreteEventSim import HookType
+    from config import CONFIG
+
+    CONFIG.NUMBER_OF_PEERS = args.peers
+    CONFIG.TOTAL_NUM_BLOCKS = args.blocks
+    CONFIG.TOTAL_NUM_TRANSACTIONS = args.blocks*CONFIG.TXN_PER_BLOCK
+    print(f"{args.peers:,} peers, {CONFIG.TOTAL_NUM_TRANSACTIONS:,} transactions")
+    for mining_mode in ("per_peer", "global"):
+        CONFIG.MINING_MODE = mining_mode
+        run = BlockchainSimulation(seed=args.seed, show_progress=False)
+        run.setup()
+        pushed = []
+        run.simulation.reg_hooks(HookType.PRE_ENQUEUE, pushed.append,
+                                 {EventType.BLOCK_MINE_FINISH})
+        start = perf_counter()
+        num_events = run.run_while(lambda run: True)
+        elapsed = perf_counter() - start
+        print(f"{mining_mode.rjust(8)}: {len(pushed):>8,} mining events pushed  "
+              f"{num_events:>10,} events  {elapsed:8.2f}s  blocks {run.blocks_broadcasted}")
+
+
+def bench_topology(args):
+    '''
+    Time to build a connected network of --peers peers, the topology arrays
+    alone and the full network (peers, block chains and links).
+    '''
+    import numpy as np
+
+    import topology
+    from config import CONFIG
+    from network import create_network
+
+    CONFIG.NUMBER_OF_PEERS = args.peers
+    print(f"{args.peers:,} peers")
+    for kind in topology.TOPOLOGIES:
+        CONFIG.TOPOLOGY = kind
+        start = perf_counter()
+        u, v = topology.connected_topology(args.peers, np.random.default_rng(args.seed))
+        arrays = perf_counter() - start
+        start = perf_counter()
+        create_network(args.peers, Simulation(seed=args.seed))
+        network = perf_counter() - start
+        print(f"{kind.rjust(14)}: {len(u):>10,} links  arrays {arrays:6.3f}s  network {network:6.2f}s")
+
+
+def bench_random_streams(args):
+    '''
+    Cost of an exponential variate: random.expovariate (rounded, as
+    utils.expon_distribution does) against the buffered NumPy stream.
+    '''
+    from RandomStreams import RandomStreams
+
+    rng = random.Random(args.seed)
+    stream = RandomStreams(args.seed).link
+    draws = {
+        "expon_distribution": lambda: expon_distribution(18.75, rng),
+        "RandomStream": lambda: stream.exponential(18.75),
+    }
+    for name, draw in draws.items():
+        start = perf_counter()
+        for _ in range(args.ops):
+            draw()
+        elapsed = perf_counter() - start
+        print(f"{name.rjust(18)}: {elapsed/args.ops*1e9:6.0f} ns/variate")
+
+
+def bench_parallel(args):
+    '''
+    Wall time of the partitioned simulation against the sequential one
+    (1 worker) on the same network and workload.
+    '''
+    from ParallelSim import ParallelSimulation
+    from config import CONFIG
+
+    CONFIG.NUMBER_OF_PEERS = args.peers
+    CONFIG.TOTAL_NUM_BLOCKS = args.blocks
+    CONFIG.TOTAL_NUM_TRANSACTIONS = args.blocks*CONFIG.TXN_PER_BLOCK
+    print(f"{args.peers:,} peers, {CONFIG.TOTAL_NUM_TRANSACTIONS:,} transactions")
+    baseline = None
+    for num_workers in args.workers:
+        parallel_sim = ParallelSimulation(num_workers, seed=args.seed)
+        start = perf_counter()
+        parallel_sim.run()
+        elapsed = perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{num_workers:>3} workers: {elapsed:8.2f}s  speedup {baseline/elapsed:5.2f}  "
+              f"windows {parallel_sim.num_windows:,}  lookahead {parallel_sim.lookahead:.2f}ms")
+
+
+BENCHMARKS = {
+    "event_queue": bench_event_queue,
+    "mining_equivalence": bench_mining_equivalence,
+    "parallel": bench_parallel,
+    "add_block": bench_add_block,
+    "balances": bench_balances,
+    "mempool": bench_mempool,
+    "dedup": bench_dedup,
+    "link_delivery": bench_link_delivery,
+    "mining_modes": bench_mining_modes,
+    "topology": bench_topology,
+    "random_streams": bench_random_streams,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=BENCHMARKS.keys())
+    parser.add_argument("--pending", type=int, default=10**6,
+                        help="number of pending events")
+    parser.add_argument("--ops", type=int, default=10**6,
+                        help="number of measured operations")
+    parser.add_argument("--seed", type=int, default=765)
+    parser.add_argument("--peers", type=int, default=1000,
+                        help="number of peers (parallel, topology, mining_modes)")
+    parser.add_argument("--blocks", type=int, default=10,
+                        help="target number of blocks (parallel, link_delivery, mining_modes)")
+    parser.add_argument("--workers", type=lambda value: [int(n) for n in value.split(",")],
+                        default=[1, 4, 8, 16],
+                        help="comma separated numbers of workers, the first is the baseline (parallel)")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
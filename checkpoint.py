@@ -0,0 +1,134 @@
+'''
+On-disk checkpoints of a running simulation.
+
+A checkpoint is the pickled run (BlockchainSimulation: event calendar,
+clock, rng state, peers with their block chains and forwarded messages),
+gzip compressed. Where os.fork is available the checkpoint is written by a
+forked child from a copy-on-write snapshot of the process, so the run only
+pauses for the fork.
+'''
+import copyreg
+import gzip
+import logging
+import os
+import pickle
+import sys
+import types
+from time import monotonic
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+COMPRESS_LEVEL = 3
+# seconds (wall clock) between checkpoints unless the run asks otherwise
+CHECKPOINT_INTERVAL = 300
+# block chains are linked lists of blocks and pickle recurses along them
+RECURSION_LIMIT = 100000
+
+
+def reduce_method(method: types.MethodType) -> tuple:
+    '''
+    Pickle bound methods by their mangled name: events keep private methods
+    (e.g. Link.__link_delay_sim) as actions, which the default reduction
+    looks up without the mangling.
+    '''
+    name = method.__func__.__name__
+    if name.startswith("__") and not name.endswith("__"):
+        class_name = method.__func__.__qualname__.rsplit(".", 2)[-2]
+        name = f"_{class_name.lstrip('_')}{name}"
+    return getattr, (method.__self__, name)
+
+
+def save_checkpoint(state: Any, path: str):
+    '''
+    Write state to path, atomically: a crash while writing leaves the
+    previous checkpoint in place.
+    '''
+    tmp_path = f"{path}.tmp"
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursion_limit, RECURSION_LIMIT))
+    try:
+        with gzip.open(tmp_path, "wb", compresslevel=COMPRESS_LEVEL) as f:
+            pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickler.dispatch_table = copyreg.dispatch_table.copy()
+            pickler.dispatch_table[types.MethodType] = reduce_method
+            pickler.dump(state)
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str) -> Any:
+    '''
+    Read back the state written by save_checkpoint.
+    '''
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursion_limit, RECURSION_LIMIT))
+    try:
+        with gzip.open(path, "rb") as f:
+            return pickle.load(f)
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+
+class CheckpointWriter:
+    '''
+    Writes a checkpoint at most every interval seconds (wall clock).
+    '''
+
+    def __init__(self, path: str, interval: float):
+        self.path: str = os.path.abspath(path)
+        self.interval: float = interval
+        self.num_written: int = 0
+        self.__last_write: float = monotonic()
+        self.__writer_pid: int = None  # forked child still writing
+
+    def __repr__(self) -> str:
+        return f"CheckpointWriter({self.path})"
+
+    def __writer_busy(self, block: bool = False) -> bool:
+        if self.__writer_pid is None:
+            return False
+        pid, status = os.waitpid(self.__writer_pid, 0 if block else os.WNOHANG)
+        if pid == 0:
+            return True
+        self.__writer_pid = None
+        if os.waitstatus_to_exitcode(status) == 0:
+            self.num_written += 1
+        else:
+            logger.warning("%s: writing the checkpoint failed", self)
+        return False
+
+    def due(self) -> bool:
+        return monotonic() - self.__last_write >= self.interval
+
+    def write(self, state: Any, background: bool = True):
+        '''
+        Checkpoint state. In the background a checkpoint is skipped while
+        the previous one is still being written.
+        '''
+        if self.__writer_busy():
+            return
+        self.__last_write = monotonic()
+        if not background or not hasattr(os, "fork"):
+            save_checkpoint(state, self.path)
+            self.num_written += 1
+            logger.info("%s: checkpoint written", self)
+            return
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                save_checkpoint(state, self.path)
+            except BaseException:
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.__writer_pid = pid
+        logger.info("%s: checkpoint started by process %d", self, pid)
+
+    def wait(self):
+        '''
+        Wait for the checkpoint being written in the background.
+        '''
+        self.__writer_busy(block=True)
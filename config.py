@@ -3,6 +3,7 @@ class CONFIG:
     Simulation configuration
     '''
     SAVE_RESULTS = False  # save results to a file
+    SEED = None  # seed of the simulation's random numbers, None for a random run
 
     # parameters as mentioned in the papers
     NUMBER_OF_PEERS = 20
@@ -30,11 +31,47 @@ class CONFIG:
     # mean of exponential time interval bw transactions (ms)
     INITIAL_COINS = 1000
     EVENT_QUEUE_TIMEOUT = 5
+    EVENT_QUEUE_BACKEND = "heap"  # "heap" or "calendar"
+    # "per_peer": a mining timer per candidate block
+    # "global": one scheduler samples the next block and its miner
+    MINING_MODE = "per_peer"
+    # "direct": messages don't queue, the arrival is scheduled as a message
+    # is sent; "send_event": as direct, a zero delay send event schedules it;
+    # "queued": a link sends one message at a time at its bandwidth, the
+    # messages queued meanwhile go out (and arrive) as one batch. Queueing
+    # changes the results (congested links deliver later, in batches), so
+    # it is opt-in
+    LINK_DELIVERY = "direct"
+    # peer network: "random_degree" (every peer links to 4 to 6 random
+    # peers), "random_regular" (TOPOLOGY_DEGREE links per peer) or
+    # "small_world" (ring of the TOPOLOGY_DEGREE nearest peers, each link
+    # rewired to a random peer with probability SMALL_WORLD_REWIRING)
+    TOPOLOGY = "random_degree"
+    TOPOLOGY_DEGREE = 4
+    SMALL_WORLD_REWIRING = 0.1
+    # blocks held back until their parent arrives: at most this many, for
+    # at most this long (ms) each
+    ORPHAN_POOL_SIZE = 1000
+    ORPHAN_MAX_AGE = AVG_BLOCK_MINING_TIME
+    # validation verdicts shared by the peers: at most this many, none for
+    # blocks this many blocks below the highest one
+    VALIDATION_CACHE_SIZE = 10000
+    VALIDATION_CACHE_DEPTH = 100
+    # ids of relayed messages a peer remembers to relay each once: "set"
+    # (all of them), "expiring" (those of the last MESSAGE_EXPIRY ms, far
+    # longer than a message takes to cross the network) or "bloom" (the last
+    # MESSAGE_BLOOM_CAPACITY in rotating Bloom filters, a new message is
+    # taken for a duplicate with probability up to 2*MESSAGE_BLOOM_FP_RATE)
+    MESSAGE_FILTER = "expiring"
+    MESSAGE_EXPIRY = 600000
+    MESSAGE_BLOOM_CAPACITY = 10000
+    MESSAGE_BLOOM_FP_RATE = 0.0001
 
     @property
     def __dict__(self) -> dict:
         return ({
             "SAVE_RESULTS": self.SAVE_RESULTS,
+            "SEED": self.SEED,
             "NUMBER_OF_PEERS": self.NUMBER_OF_PEERS,
             "Z0": self.Z0,
             "Z1": self.Z1,
@@ -49,4 +86,31 @@ class CONFIG:
             "BLOCK_TXNS_TRIGGER_THRESHOLD": self.BLOCK_TXNS_TRIGGER_THRESHOLD,
             "INITIAL_COINS": self.INITIAL_COINS,
             "EVENT_QUEUE_TIMEOUT": self.EVENT_QUEUE_TIMEOUT,
+            "EVENT_QUEUE_BACKEND": self.EVENT_QUEUE_BACKEND,
+            "MINING_MODE": self.MINING_MODE,
+            "LINK_DELIVERY": self.LINK_DELIVERY,
+            "TOPOLOGY": self.TOPOLOGY,
+            "TOPOLOGY_DEGREE": self.TOPOLOGY_DEGREE,
+            "SMALL_WORLD_REWIRING": self.SMALL_WORLD_REWIRING,
+            "ORPHAN_POOL_SIZE": self.ORPHAN_POOL_SIZE,
+            "ORPHAN_MAX_AGE": self.ORPHAN_MAX_AGE,
+            "VALIDATION_CACHE_SIZE": self.VALIDATION_CACHE_SIZE,
+            "VALIDATION_CACHE_DEPTH": self.VALIDATION_CACHE_DEPTH,
+            "MESSAGE_FILTER": self.MESSAGE_FILTER,
+            "MESSAGE_EXPIRY": self.MESSAGE_EXPIRY,
+            "MESSAGE_BLOOM_CAPACITY": self.MESSAGE_BLOOM_CAPACITY,
+            "MESSAGE_BLOOM_FP_RATE": self.MESSAGE_BLOOM_FP_RATE,
         })
+
+
+def config_snapshot() -> dict:
+    '''
+    Current CONFIG values, e.g. to reproduce the configuration of a run in
+    another process or when resuming it.
+    '''
+    return {key: value for key, value in vars(CONFIG).items() if key.isupper()}
+
+
+def restore_config(snapshot: dict):
+    for key, value in snapshot.items():
+        setattr(CONFIG, key, value)
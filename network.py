@@ -1,6 +1,14 @@
-import random
+from collections import deque
+from typing import Collection
+
+import numpy as np
+
+import topology
 from Peer import Peer
 from Link import Link
+from Block import BlockStore
+from DiscreteEventSim import Simulation
+from Mining import MiningScheduler
 from config import CONFIG
 
 
@@ -8,17 +16,17 @@ def is_connected(peers: list[Peer]):
     """
     Returns True if all peers are connected to each other, False otherwise.
     """
-    is_visited = {}
-    cur_peer = peers[0]
-    queue = [cur_peer]
-    is_visited[cur_peer.id] = True
+    if not peers:
+        return True
+    is_visited = {peers[0]}
+    queue = deque(is_visited)
     while queue:
-        cur_peer = queue.pop(0)
-        is_visited[cur_peer.id] = True
+        cur_peer = queue.popleft()
         for peer in cur_peer.neighbours.keys():
-            if peer.id not in is_visited:
+            if peer not in is_visited:
+                is_visited.add(peer)
                 queue.append(peer)
-    return all(is_visited)
+    return len(is_visited) == len(peers)
 
 
 def draw_graph(peers):
@@ -36,34 +44,41 @@ def draw_graph(peers):
     plt.show()
 
 
-def create_network(n: int) -> list[Peer]:
+def create_network(n: int, simulation: Simulation, local: Collection[int] = None) -> list[Peer]:
+    '''
+    Peers linked in a connected topology. Only the peers whose index is in
+    local (all by default) get a block chain, the others are stand-ins
+    (id and links) for peers simulated in another process.
+    '''
+    rng = simulation.rng
     is_slow_nets = [False] * n
     is_slow_cpus = [False] * n
-    for i in random.sample(list(range(n)), round(n*CONFIG.Z0)):
+    for i in rng.sample(list(range(n)), round(n*CONFIG.Z0)):
         is_slow_nets[i] = True
-    for i in random.sample(list(range(n)), round(n*CONFIG.Z1)):
+    for i in rng.sample(list(range(n)), round(n*CONFIG.Z1)):
         is_slow_cpus[i] = True
 
-    peers = [Peer(id=i, is_slow_network=is_slow_nets[i], is_slow_cpu=is_slow_cpus[i])
+    peers = [Peer(id=i, simulation=simulation,
+                  is_slow_network=is_slow_nets[i], is_slow_cpu=is_slow_cpus[i])
              for i in range(n)]
 
-    for peer in peers:
-        peer.init_blockchain(peers=peers)
+    mining_scheduler = None
+    if CONFIG.MINING_MODE == "global":
+        mining_scheduler = MiningScheduler(simulation)
+    # one block DAG for the network, each peer keeps a view of it
+    block_store = BlockStore({peer: CONFIG.INITIAL_COINS for peer in peers})
+    for i, peer in enumerate(peers):
+        if local is not None and i not in local:
+            continue
+        peer.init_blockchain(peers=peers, mining_scheduler=mining_scheduler,
+                             block_store=block_store)
 
-    for peer in peers:
-        # choose random number of neighbours
-        num_neighbours = random.randint(4, 6)
-        # num_neighbours = random.randint(2, 3)
-        random_neighbours = random.sample(
-            peers, num_neighbours)  # choose random neighbours
-        for neighbour in random_neighbours:
-            if neighbour != peer:  # don't add yourself as a neighbour
-                link = Link(peer, neighbour)
-                # add neighbour to peer
-                peer.connect(peer=neighbour, link=link)
-                # add peer to neighbour
-                neighbour.connect(peer=peer, link=link)
-    if is_connected(peers):
-        return peers
-    else:
-        return create_network(n)
+    # the topology is drawn from a stream seeded by the run's rng
+    np_rng = np.random.default_rng(rng.getrandbits(64))
+    u, v = topology.connected_topology(n, np_rng)
+    pij, cij = topology.link_parameters(u, v, np.array(is_slow_nets), np_rng)
+    for i, j, link_pij, link_cij in zip(u.tolist(), v.tolist(), pij.tolist(), cij.tolist()):
+        link = Link(peers[i], peers[j], link_pij, link_cij)
+        peers[i].connect(peer=peers[j], link=link)
+        peers[j].connect(peer=peers[i], link=link)
+    return peers
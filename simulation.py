@@ -1,26 +1,25 @@
-import random
+import argparse
 import json
 import pickle
 from time import time, strftime
+from typing import Collection
 from tqdm import tqdm
 
 from logger import init_logger
 from network import is_connected, create_network
-from DiscreteEventSim import simulation, Event, EventType, HookType
-from utils import expon_distribution, create_directory, change_directory, copy_to_directory, clear_dir
-from visualisation import visualize
+from DiscreteEventSim import Simulation, Event, EventType, HookType
+from Peer import Peer
+from Block import Block, GENESIS_BLOCK
+from utils import create_directory, change_directory, copy_to_directory, clear_dir
+from checkpoint import CHECKPOINT_INTERVAL, CheckpointWriter, load_checkpoint
 
-from config import CONFIG
+from config import CONFIG, config_snapshot, restore_config
 
 
 logger = init_logger()
 START_TIME = time()
 START_TIME = strftime("%Y-%m-%d_%H:%M:%S")
 config_instance = ''
-peers_network = []
-pbar_txns, pbar_blocks = None, None
-free_tnx_counter = 0
-blocks_broadcasted = 0
 
 
 def log_peers(peers):
@@ -34,22 +33,6 @@ def log_peers(peers):
     logger.info(is_connected(peers))
 
 
-def schedule_transactions(peers):
-    '''
-    Schedule transactions
-    '''
-    time = 0
-    while simulation.event_queue.qsize() < CONFIG.TOTAL_NUM_TRANSACTIONS:
-        # Generate exponential random variable for interarrival time
-        interarrival_time = expon_distribution(CONFIG.AVG_TXN_INTERVAL_TIME)
-        # logger.debug(f"Interarrival time: {interarrival_time}")
-        from_peer = random.choice(peers)
-        new_txn_event = Event(EventType.TXN_CREATE, time,
-                              time, from_peer.generate_random_txn, (time,), f"{from_peer} create_txn")
-        time = time + interarrival_time
-        simulation.enqueue(new_txn_event)
-
-
 def calculate_ratios(peers):
     ratios = {
         'cpu_low': {
@@ -147,66 +130,264 @@ def export_data(peers):
         json.dump(json_data, f, indent=4)
     with open('results.pkl', 'wb') as f:
         pickle.dump(json_data, f)
+    # the plotting dependencies are only needed for the results
+    from visualisation import visualize
     visualize(json_data)
 
 
-def setup_progressbars():
+class ChainStatistics:
     '''
-    Setup progress bars
+    Fork and chain statistics of a run, updated as blocks are broadcasted
+    so they can be read between steps without walking the chains.
     '''
-    global pbar_txns, pbar_blocks
-    pbar_txns = tqdm(desc='Txns: ', total=CONFIG.TOTAL_NUM_TRANSACTIONS,
-                     position=0, leave=True)
-    pbar_blocks = tqdm(
-        desc='Blks: ', total=CONFIG.TOTAL_NUM_BLOCKS, position=1, leave=True)
-
-
-def post_enqueue_hooks(event):
-    global free_tnx_counter
-    if event.type in [EventType.BLOCK_BROADCAST, EventType.BLOCK_MINE_FINISH, EventType.BLOCK_MINE_START]:
-        free_tnx_counter = 0
-
-
-def post_run_hooks(event):
-
-    def update_progress_bars():
-        global pbar_txns, pbar_blocks
-        global free_tnx_counter, blocks_broadcasted
-        if event.type == EventType.TXN_BROADCAST:
-            free_tnx_counter += 1
-            pbar_txns.update(1)
-        elif event.type == EventType.BLOCK_BROADCAST:
-            blocks_broadcasted += 1
-            pbar_blocks.update(1)
-
-    def termination_condition():
-        global blocks_broadcasted
-        if blocks_broadcasted > CONFIG.TOTAL_NUM_BLOCKS + 5:
-            simulation.stop_sim = True
-
-    def create_block_trigger():
-        global free_tnx_counter
-        if free_tnx_counter > (CONFIG.BLOCK_TXNS_TRIGGER_THRESHOLD*5):
-            miner_peer = random.choice(peers_network)
-            time_stamp = simulation.clock + 10
-            new_block_event = Event(EventType.BLOCK_CREATE, time_stamp,
-                                    time_stamp, miner_peer.block_chain.generate_block, (), f"{miner_peer} create_block")
-            simulation.enqueue(new_block_event)
-            free_tnx_counter = 0
-
-    update_progress_bars()
-    termination_condition()
-    create_block_trigger()
 
+    def __init__(self):
+        self.num_blocks: int = 0  # mined and broadcasted blocks
+        self.blocks_per_miner: dict[Peer, int] = {}
+        self.best_block: Block = GENESIS_BLOCK
+        self.best_height: int = 1
+        self.num_forks: int = 0  # blocks with more than one mined child
+        self.__heights: dict[Block, int] = {GENESIS_BLOCK: 1}
+        self.__num_children: dict[Block, int] = {}
+
+    def add_block(self, block: Block):
+        self.num_blocks += 1
+        self.blocks_per_miner[block.miner] = self.blocks_per_miner.get(
+            block.miner, 0) + 1
+        parent = block.prev_block
+        num_children = self.__num_children.get(parent, 0) + 1
+        self.__num_children[parent] = num_children
+        if num_children == 2:
+            self.num_forks += 1
+        # a miner only extends a chain it holds, the parent is known
+        height = self.__heights[parent] + 1
+        self.__heights[block] = height
+        if height > self.best_height:
+            self.best_height, self.best_block = height, block
+
+    @property
+    def num_stale_blocks(self) -> int:
+        '''
+        Broadcasted blocks off the best chain.
+        '''
+        return self.num_blocks - (self.best_height - 1)
+
+    @property
+    def stale_rate(self) -> float:
+        return self.num_stale_blocks/self.num_blocks if self.num_blocks else 0.0
+
+    def convergence(self, peers: list[Peer]) -> float:
+        '''
+        Share of the peers whose longest chain ends in the best block.
+        '''
+        return sum(peer.block_chain.longest_chain_leaf is self.best_block
+                   for peer in peers)/len(peers)
+
+    def __repr__(self) -> str:
+        return (f"ChainStatistics(blocks={self.num_blocks}, height={self.best_height}, "
+                f"forks={self.num_forks}, stale={self.num_stale_blocks})")
+
+
+class BlockchainSimulation:
+    '''
+    One run of the P2P network simulation.
 
-def add_simulation_hooks(simulation):
-
-    simulation.reg_hooks(HookType.POST_ENQUEUE, post_enqueue_hooks)
-    simulation.reg_hooks(HookType.POST_RUN, post_run_hooks)
+    Owns its Simulation, peers network and run counters, so that several
+    independent runs can live in one process (e.g. a parameter sweep over
+    seeds in a thread pool).
+    '''
 
+    def __init__(self, seed=None, queue_backend: str = None, show_progress: bool = True):
+        self.seed = seed
+        self.simulation = Simulation(queue_backend=queue_backend, seed=seed)
+        self.peers_network: list[Peer] = []
+        self.local_peers: list[Peer] = []  # peers whose events this run executes
+        self.free_tnx_counter: int = 0
+        self.txns_broadcasted: int = 0
+        # broadcasted transactions without a new block that trigger one
+        self.block_trigger_txns: float = CONFIG.BLOCK_TXNS_TRIGGER_THRESHOLD*5
+        self.blocks_broadcasted: int = 0
+        self.stats = ChainStatistics()
+        self.show_progress: bool = show_progress
+        self.pbar_txns, self.pbar_blocks = None, None
+        self.checkpointer: CheckpointWriter = None
+
+    def __getstate__(self) -> dict:
+        # progress bars and the checkpoint writer belong to the process
+        state = self.__dict__.copy()
+        state.update(pbar_txns=None, pbar_blocks=None, checkpointer=None)
+        return state
+
+    def create_network(self, local: Collection[int] = None) -> list[Peer]:
+        '''
+        Create the peers network, the first draws of the run's rng. Only the
+        peers in local (by index, all by default) get a block chain.
+        '''
+        peers = create_network(CONFIG.NUMBER_OF_PEERS, self.simulation, local)
+        logger.info("Network created")
+        log_peers(peers)
+        return peers
+
+    def setup(self):
+        '''
+        Create the network, schedule the transactions and register hooks.
+        '''
+        self.peers_network = self.create_network()
+        self.local_peers = self.peers_network
+        self.schedule_transactions()
+        logger.info("Transactions scheduled")
+        self.add_simulation_hooks()
+
+    def schedule_transactions(self):
+        '''
+        Schedule transactions
+        '''
+        simulation = self.simulation
+        local_peers = set(self.local_peers)
+        time = 0
+        for _ in range(CONFIG.TOTAL_NUM_TRANSACTIONS):
+            # Generate exponential random variable for interarrival time
+            interarrival_time = simulation.streams.workload.exponential(
+                CONFIG.AVG_TXN_INTERVAL_TIME)
+            # logger.debug(f"Interarrival time: {interarrival_time}")
+            # the workload is drawn for the whole network, even when only
+            # a part of it runs here
+            from_peer = simulation.streams.workload.choice(self.peers_network)
+            new_txn_event = Event(EventType.TXN_CREATE, time,
+                                  time, from_peer.generate_random_txn, (time,),
+                                  "%s create_txn", from_peer, owner=self)
+            time = time + interarrival_time
+            if from_peer in local_peers:
+                simulation.enqueue(new_txn_event)
+
+    def setup_progressbars(self):
+        '''
+        Setup progress bars
+        '''
+        self.pbar_txns = tqdm(desc='Txns: ', total=CONFIG.TOTAL_NUM_TRANSACTIONS,
+                              initial=self.txns_broadcasted,
+                              position=0, leave=True, disable=not self.show_progress)
+        self.pbar_blocks = tqdm(desc='Blks: ', total=CONFIG.TOTAL_NUM_BLOCKS,
+                                initial=self.blocks_broadcasted,
+                                position=1, leave=True, disable=not self.show_progress)
+
+    def post_enqueue_hooks(self, event):
+        self.free_tnx_counter = 0
+
+    def post_txn_broadcast_hooks(self, event):
+        self.free_tnx_counter += 1
+        self.txns_broadcasted += 1
+        self.pbar_txns.update(1)
+
+        # create_block_trigger
+        if self.free_tnx_counter > self.block_trigger_txns:
+            miner_peer = self.simulation.rng.choice(self.local_peers)
+            time_stamp = self.simulation.clock + 10
+            new_block_event = Event(EventType.BLOCK_CREATE, time_stamp,
+                                    time_stamp, miner_peer.block_chain.generate_block, (),
+                                    "%s create_block", miner_peer, owner=self)
+            self.simulation.enqueue(new_block_event)
+            self.free_tnx_counter = 0
+
+    def post_block_broadcast_hooks(self, event):
+        self.blocks_broadcasted += 1
+        self.stats.add_block(*event.payload)
+        self.pbar_blocks.update(1)
+
+        # termination_condition
+        if self.blocks_broadcasted > CONFIG.TOTAL_NUM_BLOCKS + 5:
+            self.simulation.stop_sim = True
+
+    def post_checkpoint_hooks(self, event):
+        # registered last, the event and its hooks are done: a consistent state
+        if self.checkpointer is None or self.simulation.stop_sim:
+            return
+        if self.checkpointer.due():
+            self.checkpointer.write({"config": config_snapshot(), "run": self})
+
+    def add_simulation_hooks(self):
+        self.simulation.reg_hooks(HookType.POST_ENQUEUE, self.post_enqueue_hooks,
+                                  {EventType.BLOCK_BROADCAST, EventType.BLOCK_MINE_FINISH, EventType.BLOCK_MINE_START})
+        self.simulation.reg_hooks(HookType.POST_RUN, self.post_txn_broadcast_hooks,
+                                  {EventType.TXN_BROADCAST})
+        self.simulation.reg_hooks(HookType.POST_RUN, self.post_block_broadcast_hooks,
+                                  {EventType.BLOCK_BROADCAST})
+        self.simulation.reg_hooks(HookType.POST_RUN, self.post_checkpoint_hooks,
+                                  {EventType.TXN_BROADCAST, EventType.BLOCK_BROADCAST})
+
+    def run(self) -> list[Peer]:
+        '''
+        Run until the termination condition, returns the peers network.
+        '''
+        if self.pbar_txns is None:
+            self.setup_progressbars()
+        try:
+            self.simulation.run()
+        finally:
+            self.pbar_txns.close()
+            self.pbar_blocks.close()
+            self.pbar_txns, self.pbar_blocks = None, None
+            if self.checkpointer is not None:
+                self.checkpointer.wait()
+        return self.peers_network
+
+    def __step(self, run_step, *args) -> int:
+        if self.pbar_txns is None:
+            self.setup_progressbars()
+        return run_step(*args)
+
+    def run_until(self, time: float) -> int:
+        '''
+        Run up to simulation time (ms), the run can be continued afterwards.
+        Returns the number of events run.
+        '''
+        return self.__step(self.simulation.run_until, time)
+
+    def run_events(self, num_events: int) -> int:
+        '''
+        Run at most num_events events, the run can be continued afterwards.
+        '''
+        return self.__step(self.simulation.run_events, num_events)
+
+    def run_while(self, predicate) -> int:
+        '''
+        Run while predicate(self) holds, it is checked before every event.
+        '''
+        return self.__step(self.simulation.run_while, lambda event: predicate(self))
+
+    @property
+    def finished(self) -> bool:
+        return self.simulation.stop_sim or not self.simulation.event_queue
+
+    def __repr__(self) -> str:
+        return "BlockchainSimulation"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="P2P cryptocurrency network simulation")
+    parser.add_argument("--resume", metavar="CHECKPOINT",
+                        help="continue the run saved in CHECKPOINT")
+    parser.add_argument("--checkpoint", metavar="PATH", nargs="?", const="checkpoint.pkl.gz",
+                        help="write checkpoints of the run to PATH (default: %(const)s), "
+                        "checkpoints are off without it")
+    parser.add_argument("--checkpoint-interval", metavar="SECONDS", type=float, default=0,
+                        help="seconds between checkpoints (default: "
+                        f"{CHECKPOINT_INTERVAL:g} with --checkpoint)")
+    args = parser.parse_args(argv)
+    if args.checkpoint_interval and not args.checkpoint:
+        parser.error("--checkpoint-interval needs --checkpoint")
+    return args
+
+
+def main(argv=None):
+    global config_instance
+    args = parse_args(argv)
 
-def main():
-    global config_instance, peers_network, pbar_txns, pbar_blocks
+    if args.resume:
+        checkpoint = load_checkpoint(args.resume)
+        restore_config(checkpoint["config"])
+        run = checkpoint["run"]
+        print(f"Resuming from {args.resume} at {run.simulation.clock:,.2f}ms")
 
     config_instance = CONFIG()
 
@@ -214,30 +395,33 @@ def main():
     for key, value in config_instance.__dict__.items():
         print(f"{key.rjust(35)}: {value}")
 
-    peers_network = create_network(CONFIG.NUMBER_OF_PEERS)
-    logger.info("Network created")
-    print("Network created")
-
-    log_peers(peers_network)
-    schedule_transactions(peers_network)
-    logger.info("Transactions scheduled")
-    print("Transactions scheduled")
+    if not args.resume:
+        run = BlockchainSimulation(seed=CONFIG.SEED)
+        run.setup()
+        print("Network created")
+        print("Transactions scheduled")
+    if args.checkpoint:
+        run.checkpointer = CheckpointWriter(
+            args.checkpoint, args.checkpoint_interval or CHECKPOINT_INTERVAL)
 
     logger.info("Simulation started")
     print("Simulation started")
     try:
-        setup_progressbars()
-        add_simulation_hooks(simulation)
-        simulation.run()
+        run.run()
         logger.info("Simulation ended")
+        logger.info("Stale events cancelled: %d",
+                    run.simulation.num_cancelled_events)
+        logger.info("Validation cache: %s",
+                    run.peers_network[0].block_chain.validation_info)
     except KeyboardInterrupt:
         logger.info("Simulation interrupted")
+        if run.checkpointer is not None and run.checkpointer.num_written:
+            print(f"Continue with --resume {run.checkpointer.path}")
     finally:
-        pbar_txns.close()
-        pbar_blocks.close()
         print("Simulation ended")
+        print(f"Stale events cancelled: {run.simulation.num_cancelled_events}")
 
-        export_data(peers_network)
+        export_data(run.peers_network)
         logger.info("Data exported")
         print("Data exported")
 
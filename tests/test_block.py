@@ -0,0 +1,160 @@
+import random
+
+import pytest
+
+from Block import Block, BlockChain, BlockStore, GENESIS_BLOCK, OrphanPool
+from config import CONFIG
+from DiscreteEventSim import Simulation, EventType, HookType
+from Transaction import Transaction
+
+PEERS = ["peer_a", "peer_b", "peer_c"]
+
+
+@pytest.fixture
+def simulation() -> Simulation:
+    return Simulation(seed=1)
+
+
+@pytest.fixture
+def chain(simulation, monkeypatch) -> BlockChain:
+    # a candidate block is made from whatever the mempool holds
+    monkeypatch.setattr(CONFIG, "BLOCK_TXNS_MIN_THRESHOLD", 0)
+    return BlockChain(simulation, 1.0, None, PEERS, PEERS[0])
+
+
+def candidate(block_chain: BlockChain, simulation: Simulation) -> Block:
+    '''
+    The block block_chain starts mining next, taken from its mempool.
+    '''
+    candidates = []
+    simulation.reg_hooks(HookType.PRE_ENQUEUE, lambda event: candidates.append(event.payload[0]),
+                         {EventType.BLOCK_MINE_START})
+    block_chain.generate_block()
+    return candidates[-1]
+
+
+def chain_of(parent: Block, transactions: list[list[Transaction]], rng: random.Random) -> list[Block]:
+    blocks = []
+    for block_transactions in transactions:
+        parent = Block(parent, block_transactions, PEERS[1], 0, rng)
+        blocks.append(parent)
+    return blocks
+
+
+def test_losing_fork_keeps_transactions_in_mempool(chain, simulation):
+    rng = random.Random(1)
+    t1 = Transaction(PEERS[1], PEERS[2], 10, 0, rng)
+    t2 = Transaction(PEERS[2], PEERS[1], 5, 0, rng)
+    chain.add_transaction(t1)
+    chain.add_transaction(t2)
+
+    for block in chain_of(GENESIS_BLOCK, [[], []], rng):
+        assert chain.add_block(block)
+    # a fork which never gets longer than the longest chain
+    for block in chain_of(GENESIS_BLOCK, [[t1], [t2]], rng):
+        assert chain.add_block(block)
+    assert chain.reorg_info["num_reorgs"] == 0
+
+    transactions = candidate(chain, simulation).transactions
+    assert t1 in transactions and t2 in transactions
+
+
+def test_reorg_moves_transactions(chain, simulation):
+    rng = random.Random(1)
+    t1 = Transaction(PEERS[1], PEERS[2], 10, 0, rng)
+    t2 = Transaction(PEERS[2], PEERS[1], 5, 0, rng)
+    chain.add_transaction(t1)
+    chain.add_transaction(t2)
+
+    old_branch = chain_of(GENESIS_BLOCK, [[t1]], rng)
+    assert chain.add_block(old_branch[0])
+    assert chain.longest_chain_leaf is old_branch[0]
+    assert candidate(chain, simulation).transactions == [t2]
+
+    for block in chain_of(GENESIS_BLOCK, [[t2], []], rng):
+        assert chain.add_block(block)
+    assert chain.reorg_info["num_reorgs"] == 1
+    assert chain.reorg_info["reinjected_txns"] == 1
+    # t1 is back, t2 is on the new longest chain
+    assert candidate(chain, simulation).transactions == [t1]
+
+
+def forked_store(rng: random.Random, num_blocks: int = 300) -> tuple[BlockStore, list[Block], list[Transaction]]:
+    '''
+    A store of blocks each extending one of the last few, so the chain
+    forks often and is deep enough for the skip pointers. Some blocks carry
+    a transaction, the same transaction can be in blocks on different forks.
+    '''
+    store = BlockStore({peer: 1000 for peer in PEERS})
+    transactions = [Transaction(PEERS[1], PEERS[2], 1, 0, rng) for _ in range(20)]
+    blocks = [GENESIS_BLOCK]
+    for _ in range(num_blocks):
+        parent = rng.choice(blocks[-5:])
+        block_transactions = [rng.choice(transactions)] if rng.random() < 0.3 else []
+        block = Block(parent, block_transactions, PEERS[1], 0, rng)
+        store.add(block)
+        blocks.append(block)
+    return store, blocks, transactions
+
+
+def ancestors(block: Block) -> list[Block]:
+    '''
+    block and its ancestors down to the genesis block, by walking the parents.
+    '''
+    chain = []
+    while block is not None:
+        chain.append(block)
+        block = block.prev_block
+    return chain
+
+
+def test_ancestor_and_includes_match_parent_walk():
+    rng = random.Random(3)
+    store, blocks, transactions = forked_store(rng)
+    assert max(store.height(block) for block in blocks) > 50
+    for block in blocks:
+        chain = ancestors(block)
+        assert store.height(block) == len(chain)
+        for ancestor in chain:
+            assert store.ancestor(block, store.height(ancestor)) is ancestor
+            assert store.is_ancestor(ancestor, block)
+        for other in rng.sample(blocks, 10):
+            assert store.is_ancestor(other, block) == (other in chain)
+        for transaction in transactions:
+            assert store.includes(block, transaction) == any(
+                transaction in ancestor.transactions for ancestor in chain)
+    with pytest.raises(ValueError):
+        store.ancestor(blocks[1], store.height(blocks[1]) + 1)
+
+
+def test_orphan_connects_when_parent_arrives(chain):
+    rng = random.Random(1)
+    parent, child, grandchild = chain_of(GENESIS_BLOCK, [[], [], []], rng)
+    assert not chain.add_block(grandchild)
+    assert not chain.add_block(child)
+    assert chain.longest_chain_leaf is GENESIS_BLOCK
+
+    assert chain.add_block(parent)
+    assert chain.longest_chain_leaf is grandchild
+    assert chain.longest_chain_length == 4
+
+
+def test_orphan_pool_evicts_oldest_at_capacity():
+    rng = random.Random(1)
+    orphans = OrphanPool(max_size=2, max_age=float("inf"))
+    blocks = [Block(GENESIS_BLOCK, [], PEERS[1], 0, rng) for _ in range(3)]
+    for time, block in enumerate(blocks):
+        assert orphans.add(block, time)
+    assert len(orphans) == 2 and orphans.num_evicted == 1
+    assert blocks[0] not in orphans
+    assert orphans.pop_children(GENESIS_BLOCK) == blocks[1:]
+
+
+def test_orphan_pool_rejects_duplicate():
+    rng = random.Random(1)
+    orphans = OrphanPool(max_size=2, max_age=float("inf"))
+    block = Block(GENESIS_BLOCK, [], PEERS[1], 0, rng)
+    assert orphans.add(block, 0)
+    assert not orphans.add(block, 1)
+    assert len(orphans) == 1
+    assert orphans.pop_children(GENESIS_BLOCK) == [block]
@@ -0,0 +1,57 @@
+import pytest
+
+from checkpoint import load_checkpoint, save_checkpoint
+from config import CONFIG, config_snapshot, restore_config
+from DiscreteEventSim import DEBUG_EVENT_TYPES, EventType, HookType
+from simulation import BlockchainSimulation
+
+
+@pytest.fixture
+def small_run(monkeypatch):
+    monkeypatch.setattr(CONFIG, "NUMBER_OF_PEERS", 8)
+    monkeypatch.setattr(CONFIG, "TOTAL_NUM_BLOCKS", 3)
+    monkeypatch.setattr(CONFIG, "TOTAL_NUM_TRANSACTIONS", 1200)
+    monkeypatch.setattr(CONFIG, "AVG_BLOCK_MINING_TIME", 200*1000)
+
+
+def traced(run: BlockchainSimulation) -> list:
+    '''
+    The events run from now on. Send events are left out, tracing them
+    would make the links schedule them (see Link.send).
+    '''
+    trace = []
+    # a bound list method, the hook is pickled with the run
+    run.simulation.reg_hooks(HookType.POST_RUN, trace.append,
+                             set(EventType) - DEBUG_EVENT_TYPES)
+    return trace
+
+
+def summary(trace: list) -> list[tuple]:
+    return [(event.type, event.actionable_at, str(event)) for event in trace]
+
+
+def test_resume_matches_uninterrupted_run(small_run, tmp_path):
+    uninterrupted = BlockchainSimulation(seed=5, show_progress=False)
+    uninterrupted.setup()
+    expected = traced(uninterrupted)
+    uninterrupted.run()
+    assert uninterrupted.stats.num_blocks > 1
+
+    # after the first blocks, while the last one is mined
+    num_events = 37000
+    run = BlockchainSimulation(seed=5, show_progress=False)
+    run.setup()
+    trace = traced(run)
+    assert run.run_events(num_events) == num_events
+    assert 0 < run.stats.num_blocks < uninterrupted.stats.num_blocks
+    assert not run.finished
+    path = tmp_path / "checkpoint.pkl.gz"
+    save_checkpoint({"config": config_snapshot(), "run": run, "trace": trace}, path)
+    del run, trace
+
+    checkpoint = load_checkpoint(path)
+    restore_config(checkpoint["config"])
+    resumed, trace = checkpoint["run"], checkpoint["trace"]
+    resumed.run()
+    assert summary(trace) == summary(expected)
+    assert repr(resumed.stats) == repr(uninterrupted.stats)
@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from DiscreteEventSim import EVENT_QUEUE_BACKENDS, Event, EventQueue, EventType
+
+
+def run_operations(backend: str, seed: int, num_operations: int = 20000) -> list[int]:
+    '''
+    Push order (payload) of the events popped by a random mix of push, pop and cancel
+    operations, the same mix for every backend.
+    '''
+    rng = random.Random(seed)
+    queue = EVENT_QUEUE_BACKENDS[backend]()
+    handles = []
+    popped = []
+    clock = 0.0
+    for _ in range(num_operations):
+        operation = rng.random()
+        if operation < 0.5 or not queue:
+            # exponential gaps with ties, and now and then a far future event
+            delay = round(rng.expovariate(1 / 600), 1) if rng.random() < 0.95 else rng.uniform(1e5, 1e6)
+            event = Event(EventType.TXN_CREATE, clock, delay, None, (len(handles),))
+            handles.append(queue.push(event))
+        elif operation < 0.8:
+            assert queue.peek() is queue.peek()
+            event = queue.pop()
+            assert event.actionable_at >= clock
+            clock = event.actionable_at
+            popped.append(event.payload[0])
+        else:
+            queue.cancel(handles[rng.randrange(len(handles))])
+    while queue:
+        popped.append(queue.pop().payload[0])
+    return popped
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_calendar_queue_matches_heap(seed):
+    expected = run_operations("heap", seed)
+    assert run_operations("calendar", seed) == expected
+
+
+@pytest.mark.parametrize("backend", EVENT_QUEUE_BACKENDS)
+def test_cancel(backend):
+    queue = EVENT_QUEUE_BACKENDS[backend]()
+    first = queue.push(Event(EventType.TXN_CREATE, 0, 1, None, ()))
+    second = Event(EventType.TXN_CREATE, 0, 2, None, ())
+    queue.push(second)
+    assert queue.cancel(first)
+    assert not queue.cancel(first)
+    assert len(queue) == 1
+    assert queue.pop() is second
+    assert not queue
+    with pytest.raises(IndexError):
+        queue.pop()
+
+
+def test_event_queue_is_abstract():
+    with pytest.raises(TypeError):
+        EventQueue()
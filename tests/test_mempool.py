@@ -0,0 +1,75 @@
+import random
+from itertools import count
+
+from Balances import BranchBalances
+from Mempool import Mempool
+from Transaction import Transaction
+
+PEERS = [f"peer_{i}" for i in range(5)]
+
+
+def greedy_template(pending: dict[Transaction, int], balances: BranchBalances) -> list[Transaction]:
+    '''
+    Each sender's transactions in timestamp (then arrival) order, while the
+    sender's balance covers them.
+    '''
+    remaining = {}
+    template = []
+    for transaction in sorted(pending, key=lambda transaction: (transaction.timestamp,
+                                                                 pending[transaction])):
+        sender = transaction.from_id
+        balance = remaining.get(sender, balances[sender])
+        if balance >= transaction.amount:
+            remaining[sender] = balance - transaction.amount
+            template.append(transaction)
+    return template
+
+
+def test_template_matches_greedy_selection():
+    rng = random.Random(4)
+    balances = BranchBalances.initial({peer: 10.0 for peer in PEERS})
+    mempool = Mempool(balances)
+    pending = {}  # transaction -> arrival, the reference mempool
+    removed = []
+    arrivals = count()
+    time = 0.0
+    for step in range(5000):
+        action = rng.random()
+        if action < 0.45:
+            # mostly in order, now and then late or at the same time
+            time += rng.choice([0.0, 1.0, 1.0, 1.0])
+            timestamp = time - rng.uniform(0, 20) if rng.random() < 0.2 else time
+            amount = rng.choice([0.0, rng.uniform(0, 4)])
+            transaction = Transaction(*rng.sample(PEERS, 2), amount, timestamp, rng)
+            mempool.add(transaction)
+            pending[transaction] = next(arrivals)
+        elif action < 0.55 and removed:
+            # back from a block leaving the chain
+            transaction = removed.pop(rng.randrange(len(removed)))
+            mempool.add(transaction)
+            pending.setdefault(transaction, next(arrivals))
+        elif action < 0.7 and pending:
+            transaction = rng.choice(list(pending))
+            assert mempool.remove(transaction)
+            assert not mempool.remove(transaction)
+            del pending[transaction]
+            removed.append(transaction)
+        elif action < 0.85:
+            # a block with the start of the template becomes the tip
+            block = mempool.template()[:rng.randrange(8)]
+            for transaction in block:
+                assert mempool.remove(transaction)
+                del pending[transaction]
+            balances = balances.after(block)
+            changed = {transaction.from_id for transaction in block}
+            changed.update(transaction.to_id for transaction in block)
+            mempool.set_balances(balances, changed)
+        else:
+            # a tip elsewhere
+            balances = BranchBalances.initial({peer: rng.uniform(0, 20) for peer in PEERS})
+            mempool.set_balances(balances, None if rng.random() < 0.5 else set(PEERS))
+        assert len(mempool) == len(pending)
+        if step % 3 == 0:
+            template = mempool.template()
+            assert template == greedy_template(pending, balances)
+            assert mempool.template_size() == len(template)
@@ -0,0 +1,37 @@
+import pytest
+
+from MessageFilter import MESSAGE_FILTERS, MessageFilter, ExpiringSet, RotatingBloomFilter
+
+
+@pytest.mark.parametrize("name", MESSAGE_FILTERS)
+def test_remembers_recent_messages(name):
+    message_filter = MESSAGE_FILTERS[name]()
+    for i in range(1000):
+        message_filter.add(f"msg{i}", i)
+    assert all(f"msg{i}" in message_filter for i in range(1000))
+    assert len(message_filter) == 1000
+
+
+def test_expiring_set_forgets_old_messages():
+    message_filter = ExpiringSet(expiry=100)
+    message_filter.add("old", 0)
+    message_filter.add("recent", 150)
+    assert "old" in message_filter
+    message_filter.add("new", 250)
+    assert "old" not in message_filter
+    assert "recent" in message_filter and "new" in message_filter
+
+
+def test_bloom_filter_is_bounded():
+    message_filter = RotatingBloomFilter(capacity=100, fp_rate=0.01)
+    for i in range(1000):
+        message_filter.add(f"msg{i}", i)
+    assert len(message_filter) <= 200
+    assert all(f"msg{i}" in message_filter for i in range(900, 1000))
+    false_positives = sum(f"other{i}" in message_filter for i in range(10000))
+    assert false_positives < 2 * 2 * 0.01 * 10000
+
+
+def test_message_filter_is_abstract():
+    with pytest.raises(TypeError):
+        MessageFilter()
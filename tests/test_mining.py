@@ -0,0 +1,62 @@
+import pytest
+
+from config import CONFIG
+from DiscreteEventSim import Simulation, EventType, HookType
+from network import create_network
+
+
+def mine_blocks(mining_mode: str, num_blocks: int, seed: int) -> tuple[list, list[float]]:
+    '''
+    Mine num_blocks blocks on a small network of real peers, returns the
+    miners (peer indices) and the times between the blocks found.
+    '''
+    CONFIG.MINING_MODE = mining_mode
+    simulation = Simulation(seed=seed)
+    peers = create_network(CONFIG.NUMBER_OF_PEERS, simulation)
+    miners, times = [], []
+
+    def block_found(event):
+        block, = event.payload
+        miners.append(peers.index(block.miner))
+        times.append(simulation.clock)
+        if len(miners) >= num_blocks:
+            simulation.stop_sim = True
+
+    simulation.reg_hooks(HookType.POST_RUN, block_found, {EventType.BLOCK_BROADCAST})
+    for peer in peers:
+        peer.block_chain.generate_block()
+    simulation.run()
+    intervals = [b - a for a, b in zip([0.0] + times, times)]
+    return miners, intervals
+
+
+def test_global_mining_matches_per_peer(monkeypatch):
+    '''
+    Same block interval distribution and the same share of blocks per miner
+    (two sample chi-square test at 99.9%) with per-peer timers and with
+    the global scheduler.
+    '''
+    num_peers, num_blocks = 10, 2000
+    monkeypatch.setattr(CONFIG, "NUMBER_OF_PEERS", num_peers)
+    # empty blocks, mining doesn't wait for transactions
+    monkeypatch.setattr(CONFIG, "BLOCK_TXNS_MIN_THRESHOLD", 0)
+    monkeypatch.setattr(CONFIG, "MINING_MODE", CONFIG.MINING_MODE)
+
+    # the same seed builds the same network
+    per_peer_miners, per_peer_intervals = mine_blocks("per_peer", num_blocks, seed=1)
+    global_miners, global_intervals = mine_blocks("global", num_blocks, seed=1)
+
+    chi2 = 0.0
+    for peer in range(num_peers):
+        a, b = per_peer_miners.count(peer), global_miners.count(peer)
+        if a + b:
+            chi2 += (a - b)**2 / (a + b)
+    dof = num_peers - 1
+    # Wilson-Hilferty approximation of the 99.9% chi-square quantile
+    critical = dof * (1 - 2/(9*dof) + 3.09*(2/(9*dof))**0.5)**3
+    assert chi2 < critical
+
+    # the intervals are about exponential: standard deviation = mean
+    mean = sum(per_peer_intervals) / num_blocks
+    assert sum(global_intervals) / num_blocks == pytest.approx(
+        mean, abs=4*mean*(2/num_blocks)**0.5)
@@ -0,0 +1,25 @@
+import pytest
+
+from DiscreteEventSim import Simulation
+from RandomStreams import RandomStreams
+
+
+def draws(streams: RandomStreams) -> list[float]:
+    return [streams.link.exponential(1), streams.mining.random(), streams.workload.uniform(0, 10)]
+
+
+@pytest.mark.parametrize("seed", [0, 1, -1, -2**70, 2**200, "1/0", 1.5])
+def test_seeds_are_reproducible(seed):
+    assert draws(RandomStreams(seed)) == draws(RandomStreams(seed))
+    Simulation(seed=seed)
+
+
+def test_seeds_differ():
+    assert len({tuple(draws(RandomStreams(seed))) for seed in (0, 1, -1, "1", "-1")}) == 5
+
+
+def test_purposes_are_independent():
+    streams, other = RandomStreams(1), RandomStreams(1)
+    for _ in range(10):
+        other.link.exponential(1)
+    assert streams.mining.random() == other.mining.random()
@@ -0,0 +1,51 @@
+import random
+
+from DiscreteEventSim import Simulation, Event, EventType
+
+
+def schedule(simulation: Simulation, ran: list, seed: int = 0, num_events: int = 200):
+    '''
+    Events which log when they run and now and then schedule another one.
+    '''
+    rng = random.Random(seed)
+
+    def action(i: int):
+        ran.append((i, simulation.clock))
+        if rng.random() < 0.3:
+            simulation.enqueue(Event(EventType.TXN_CREATE, simulation.clock,
+                                     rng.expovariate(1/10), action, (-i,)))
+
+    for i in range(num_events):
+        simulation.enqueue(Event(EventType.TXN_CREATE, 0, rng.uniform(0, 1000), action, (i,)))
+
+
+def test_steps_match_run():
+    expected = []
+    simulation = Simulation(seed=1)
+    schedule(simulation, expected)
+    simulation.run()
+
+    ran = []
+    simulation = Simulation(seed=1)
+    schedule(simulation, ran)
+    assert simulation.run_events(0) == 0
+    assert simulation.run_events(10) == 10
+    num_events = simulation.run_until(500)
+    assert simulation.clock == 500
+    assert all(time < 500 for _, time in ran)
+    num_events += simulation.run_while(lambda event: len(ran) < 150)
+    assert len(ran) == 150 == 10 + num_events
+    simulation.run()
+    assert ran == expected
+
+
+def test_stop_sim():
+    ran = []
+    simulation = Simulation(seed=1)
+    schedule(simulation, ran)
+    simulation.enqueue(Event(EventType.TXN_CREATE, 0, 100, setattr, (simulation, "stop_sim", True)))
+    simulation.run()
+    assert simulation.clock == 100
+    assert simulation.run_events(10) == 0
+    assert simulation.run_until(200) == 0
+    assert simulation.clock == 100
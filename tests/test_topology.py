@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import topology
+from config import CONFIG
+from network import is_connected
+
+
+class Node:
+    '''
+    Stand-in for a Peer, network.is_connected only reads its neighbours.
+    '''
+
+    def __init__(self):
+        self.neighbours = {}
+
+
+def nodes_of(n: int, u: np.ndarray, v: np.ndarray) -> list[Node]:
+    nodes = [Node() for _ in range(n)]
+    for a, b in zip(u.tolist(), v.tolist()):
+        nodes[a].neighbours[nodes[b]] = None
+        nodes[b].neighbours[nodes[a]] = None
+    return nodes
+
+
+def test_disconnected_graph():
+    # two triangles: every peer has neighbours, yet the network is split
+    # (the check used to report every network as connected)
+    u, v = np.array([0, 0, 1, 3, 3, 4]), np.array([1, 2, 2, 4, 5, 5])
+    assert not is_connected(nodes_of(6, u, v))
+    assert not topology.is_connected(*topology.to_csr(6, u, v))
+    u, v = np.append(u, 2), np.append(v, 3)
+    assert is_connected(nodes_of(6, u, v))
+    assert topology.is_connected(*topology.to_csr(6, u, v))
+
+
+def test_csr_bfs_matches_deque_bfs():
+    rng = np.random.default_rng(2)
+    results = set()
+    for _ in range(300):
+        n = int(rng.integers(1, 40))
+        # sparse enough for about half the graphs to be split
+        num_edges = int(rng.integers(0, 2 * n))
+        u, v = topology.unique_edges(n, rng.integers(0, n, num_edges), rng.integers(0, n, num_edges))
+        connected = is_connected(nodes_of(n, u, v))
+        assert topology.is_connected(*topology.to_csr(n, u, v)) == connected
+        results.add(connected)
+    assert results == {True, False}
+
+
+@pytest.mark.parametrize("kind", topology.TOPOLOGIES)
+def test_connected_topology(kind):
+    u, v = topology.connected_topology(200, np.random.default_rng(1), kind)
+    assert topology.is_connected(*topology.to_csr(200, u, v))
+
+
+def test_connected_topology_gives_up(monkeypatch):
+    monkeypatch.setattr(CONFIG, "TOPOLOGY_DEGREE", 0)
+    with pytest.raises(ValueError):
+        topology.connected_topology(10, np.random.default_rng(1), "random_regular")
@@ -0,0 +1,148 @@
+'''
+Peer network topologies as NumPy arrays.
+
+A topology is an undirected edge list (u, v) with u < v, no self loops and
+no duplicate edges, in ascending (u, v) order. to_csr turns it into CSR
+adjacency arrays (indptr, indices): the neighbours of peer i are
+indices[indptr[i]:indptr[i + 1]]. Nothing here loops over peers in Python,
+building and checking a graph of 50k peers takes a fraction of a second.
+'''
+import numpy as np
+
+from config import CONFIG
+
+# draws of a topology before connected_topology gives up
+MAX_ATTEMPTS = 100
+
+
+def unique_edges(n: int, u: np.ndarray, v: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Undirected edges without self loops and duplicates, in (u, v) order.
+    '''
+    u, v = np.minimum(u, v), np.maximum(u, v)
+    keys = np.unique(u[u != v].astype(np.int64) * n + v[u != v])
+    return keys // n, keys % n
+
+
+def random_degree_graph(n: int, rng: np.random.Generator,
+                        min_degree: int = 4, max_degree: int = 6) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Every peer links to min_degree to max_degree other random peers (fewer
+    on the rare repeated pick), so the degrees are at least about min_degree.
+    '''
+    degrees = rng.integers(min_degree, max_degree + 1, size=n)
+    u = np.repeat(np.arange(n), degrees)
+    # a random other peer: draw from n - 1 and skip over u itself
+    v = rng.integers(0, n - 1, size=len(u))
+    v += v >= u
+    return unique_edges(n, u, v)
+
+
+def random_regular_graph(n: int, degree: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Union of degree // 2 random Hamiltonian cycles (and a random perfect
+    matching for an odd degree, n even): connected by construction and
+    degree-regular but for the rare edge two cycles share.
+    '''
+    if degree % 2 and n % 2:
+        raise ValueError("an odd degree needs an even number of peers")
+    us, vs = [], []
+    for _ in range(degree // 2):
+        cycle = rng.permutation(n)
+        us.append(cycle)
+        vs.append(np.roll(cycle, -1))
+    if degree % 2:
+        pairs = rng.permutation(n).reshape(-1, 2)
+        us.append(pairs[:, 0])
+        vs.append(pairs[:, 1])
+    return unique_edges(n, np.concatenate(us), np.concatenate(vs))
+
+
+def small_world_graph(n: int, degree: int, rewiring: float,
+                      rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Watts-Strogatz: a ring where every peer links to its degree nearest
+    peers, then every link moves its far end to a random peer with
+    probability rewiring.
+    '''
+    u = np.tile(np.arange(n), degree // 2)
+    v = (u + np.repeat(np.arange(1, degree // 2 + 1), n)) % n
+    rewired = rng.random(len(v)) < rewiring
+    v[rewired] = rng.integers(0, n, size=rewired.sum())
+    return unique_edges(n, u, v)
+
+
+TOPOLOGIES = {
+    "random_degree": lambda n, rng: random_degree_graph(n, rng),
+    "random_regular": lambda n, rng: random_regular_graph(n, CONFIG.TOPOLOGY_DEGREE, rng),
+    "small_world": lambda n, rng: small_world_graph(
+        n, CONFIG.TOPOLOGY_DEGREE, CONFIG.SMALL_WORLD_REWIRING, rng),
+}
+
+
+def to_csr(n: int, u: np.ndarray, v: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    CSR adjacency (indptr, indices) of the undirected edges (u, v).
+    '''
+    sources = np.concatenate([u, v])
+    targets = np.concatenate([v, u])
+    order = np.argsort(sources, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+    return indptr, targets[order]
+
+
+def is_connected(indptr: np.ndarray, indices: np.ndarray) -> bool:
+    '''
+    Breadth first search from peer 0, O(V + E): every peer enters the
+    frontier once and its neighbours are read once.
+    '''
+    n = len(indptr) - 1
+    if n == 0:
+        return True
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    num_visited = 1
+    slot = np.empty(n, dtype=np.int64)  # de-duplicates a frontier in O(size)
+    frontier = np.zeros(1, dtype=np.int64)
+    while len(frontier):
+        starts = indptr[frontier]
+        lengths = indptr[frontier + 1] - starts
+        total = lengths.sum()
+        if total == 0:
+            break
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        neighbours = indices[positions]
+        neighbours = neighbours[~visited[neighbours]]
+        order = np.arange(len(neighbours))
+        slot[neighbours] = order
+        frontier = neighbours[slot[neighbours] == order]
+        visited[frontier] = True
+        num_visited += len(frontier)
+    return num_visited == n
+
+
+def connected_topology(n: int, rng: np.random.Generator, kind: str = None) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Edges of a connected topology of the given kind (CONFIG.TOPOLOGY by
+    default), redrawn until connected. Raises ValueError if none of
+    MAX_ATTEMPTS draws is (e.g. a degree of 0).
+    '''
+    kind = kind or CONFIG.TOPOLOGY
+    build = TOPOLOGIES[kind]
+    for _ in range(MAX_ATTEMPTS):
+        u, v = build(n, rng)
+        if n <= 1 or is_connected(*to_csr(n, u, v)):
+            return u, v
+    raise ValueError(f"no connected {kind} topology of {n} peers in {MAX_ATTEMPTS} attempts")
+
+
+def link_parameters(u: np.ndarray, v: np.ndarray, is_slow_network: np.ndarray,
+                    rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Propagation delay pij (ms) and bandwidth cij (kB/ms) of every link: a
+    link is slow (5 Mbps, else 100 Mbps) if either end is.
+    '''
+    pij = rng.uniform(10, 501, size=len(u))
+    cij = np.where(is_slow_network[u] | is_slow_network[v], 5, 100) * 1024 / (8 * 1000)
+    return pij, cij
@@ -3,22 +3,22 @@ import random
 import os
 
 
-def generate_random_id(length=4):
+def generate_random_id(length=4, rng: random.Random = random):
     # Define the characters to choose from
     characters = string.ascii_uppercase + \
         string.digits  # You can customize this as needed
 
     # Generate a random 4-character ID
-    random_id = ''.join(random.choice(characters) for _ in range(length))
+    random_id = ''.join(rng.choice(characters) for _ in range(length))
 
     return random_id
 
 
-def expon_distribution(mean: float):
+def expon_distribution(mean: float, rng: random.Random = random):
     '''
     Generate a random number from exponential distribution with given mean
     '''
-    sample = random.expovariate(1/mean)
+    sample = rng.expovariate(1/mean)
     return round(sample, 6)
 
 
@@ -61,3 +61,12 @@ def clear_dir(dir):
         os.system(f'rm -r {dir}/*')
     except OSError as e:
         print('unable to clear graph directory', e)
+
+
+def set_instance_state(obj, state: dict):
+    '''
+    __setstate__ for classes whose __dict__ property is an export view:
+    unpickling would update the view, so set the attributes one by one.
+    '''
+    for name, value in state.items():
+        setattr(obj, name, value)